@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# GRBL-like controller on a pseudo-terminal, for streaming benchmarks without hardware
+
+import os
+import re
+import sys
+import pty
+import tty
+import math
+import time
+import select
+import argparse
+import threading
+from collections import deque
+
+RX_BUFFER_SIZE = 128
+PLANNER_BLOCKS = 15
+DEFAULT_BAUD = 115200
+# mm/min for G0, and for G1 when no usable feed (F0) is set
+RAPID_RATE = 5000.0
+DEFAULT_FEED = 1000.0
+# Seconds a reply takes to reach the host (USB serial adapters batch
+# responses; FTDI chips default to a 16 ms latency timer)
+DEFAULT_LATENCY = 0.004
+
+_WORD_RE = re.compile(r'([A-Z])([-+]?\d*\.?\d+)')
+# Dwell and spindle (pen) commands wait for all queued motion to finish
+_SYNC_RE = re.compile(r'G0*4(?![\d.])|M0*[345](?![\d.])')
+# Realtime commands are acted on immediately and never enter the RX buffer
+_REALTIME = {ord('?'), ord('!'), ord('~'), 0x18}
+
+
+class GrblSimulator:
+    """
+    Pretends to be a GRBL 1.1 controller behind a pty.  Bytes arrive at
+    the serial wire rate into a RX_BUFFER_SIZE receive buffer; a line is
+    parsed (and acknowledged with 'ok') once the planner has a free block;
+    planned moves take their feed-rate time (scaled by time_scale) to run.
+    M3/M5 and G4 wait for the planner to empty, as GRBL's do.  Replies
+    reach the host `latency` seconds after they are sent.
+
+    stats records what a streamer is judged by: RX buffer overflows
+    (bytes that a real controller would have dropped), the peak RX fill,
+    and 'starved_seconds', the time the machine sat idle between moves
+    while the job was still running.
+    """
+
+    def __init__(self, rx_buffer=RX_BUFFER_SIZE, planner_blocks=PLANNER_BLOCKS, baud=DEFAULT_BAUD,
+                 time_scale=1.0, default_feed=DEFAULT_FEED, latency=DEFAULT_LATENCY):
+        self.rx_buffer = rx_buffer
+        self.planner_blocks = planner_blocks
+        self.byte_seconds = 10.0 / baud
+        self.time_scale = time_scale
+        self.default_feed = default_feed
+        self.latency = latency
+        self._replies = deque()
+        self.stats = {'lines': 0, 'overflows': 0, 'max_rx': 0, 'starved_seconds': 0.0, 'motion_seconds': 0.0}
+        self.position = (0.0, 0.0)
+        self.feed = 0.0
+        self.motion = 'G0'
+        self._stop = threading.Event()
+        self._thread = None
+        self.master = None
+        self.port_path = None
+
+    def start(self):
+        self.master, slave = pty.openpty()
+        tty.setraw(self.master)
+        self.port_path = os.ttyname(slave)
+        # keep the slave open so the pty survives clients reconnecting
+        self._slave = slave
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self.port_path
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        os.close(self.master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _reply(self, text):
+        self._replies.append((time.monotonic() + self.latency, text.encode() + b'\r\n'))
+
+    def _send_due_replies(self, now):
+        while self._replies and self._replies[0][0] <= now:
+            os.write(self.master, self._replies.popleft()[1])
+
+    def _move_seconds(self, words):
+        x = words.get('X', self.position[0])
+        y = words.get('Y', self.position[1])
+        distance = math.hypot(x - self.position[0], y - self.position[1])
+        self.position = (x, y)
+        rate = RAPID_RATE if self.motion == 'G0' else (self.feed or self.default_feed)
+        return distance / rate * 60.0 * self.time_scale
+
+    def _parse(self, line):
+        """Seconds of motion (or dwell) one line adds to the planner."""
+        words = {letter: float(value) for letter, value in _WORD_RE.findall(line)}
+        if 'F' in words:
+            self.feed = words['F']
+        codes = {f'{letter}{int(value)}' for letter, value in _WORD_RE.findall(line) if letter in 'GM'}
+        if codes & {'G0', 'G1'}:
+            self.motion = 'G0' if 'G0' in codes else 'G1'
+        if 'G4' in codes:
+            return words.get('P', 0.0) * self.time_scale
+        if 'X' in words or 'Y' in words:
+            return self._move_seconds(words)
+        return 0.0
+
+    def _run(self):
+        rx = bytearray()
+        planner = deque()
+        wire_clock = time.monotonic()
+        idle_since = None
+        started = False
+        while not self._stop.is_set():
+            now = time.monotonic()
+            while planner and planner[0] <= now:
+                planner.popleft()
+            if started and not planner and idle_since is None:
+                idle_since = now
+
+            # parse buffered lines while the planner can take them
+            while b'\n' in rx and len(planner) < self.planner_blocks:
+                raw, _, rest = bytes(rx).partition(b'\n')
+                line = raw.decode(errors='replace').strip().upper()
+                if line.startswith('$'):
+                    rx[:] = rest
+                    self._reply('ok')
+                    continue
+                if planner and _SYNC_RE.search(line):
+                    break
+                rx[:] = rest
+                seconds = self._parse(line)
+                started = started or bool(line)
+                if seconds > 0:
+                    if idle_since is not None:
+                        self.stats['starved_seconds'] += now - idle_since
+                        idle_since = None
+                    begin = planner[-1] if planner else now
+                    planner.append(begin + seconds)
+                    self.stats['motion_seconds'] += seconds
+                self.stats['lines'] += 1
+                self._reply('ok')
+
+            self._send_due_replies(now)
+            timeout = 0.05
+            if planner:
+                timeout = min(timeout, max(0.0, planner[0] - now))
+            if self._replies:
+                timeout = min(timeout, max(0.0, self._replies[0][0] - now))
+            if not select.select([self.master], [], [], timeout)[0]:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                # no client has the pty open
+                time.sleep(0.05)
+                continue
+            for byte in data:
+                if byte in _REALTIME:
+                    if byte == ord('?'):
+                        self._reply(f"<{'Run' if planner else 'Idle'}|MPos:{self.position[0]:.3f},"
+                                    f"{self.position[1]:.3f},0.000|Bf:{self.planner_blocks - len(planner)},"
+                                    f"{self.rx_buffer - len(rx)}>")
+                    elif byte == 0x18:
+                        rx.clear()
+                        planner.clear()
+                        self._replies.clear()
+                        self._reply("Grbl 1.1h ['$' for help]")
+                    continue
+                rx.append(byte)
+            if len(rx) > self.rx_buffer:
+                self.stats['overflows'] += 1
+            self.stats['max_rx'] = max(self.stats['max_rx'], len(rx))
+            # bytes cannot arrive faster than the serial line carries them
+            wire_clock = max(wire_clock, now) + len(data) * self.byte_seconds
+            delay = wire_clock - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a GRBL-like controller on a pseudo-terminal')
+    parser.add_argument('--baud', type=int, default=DEFAULT_BAUD, help='Simulated serial speed')
+    parser.add_argument('--rx-buffer', type=int, default=RX_BUFFER_SIZE, help='Receive buffer in bytes')
+    parser.add_argument('--planner-blocks', type=int, default=PLANNER_BLOCKS, help='Planner queue length')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='Multiplier for motion time (0 = moves complete instantly)')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help='Seconds each reply takes to reach the host')
+    args = parser.parse_args()
+    with GrblSimulator(args.rx_buffer, args.planner_blocks, args.baud, args.time_scale,
+                       latency=args.latency) as sim:
+        print(f"Simulated controller on {sim.port_path} (Ctrl-C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(sim.stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Replay a captured conversion traffic trace (/api/convert and /api/convert/stream) against a local server
+
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+import argparse
+import threading
+import requests
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+import warnings
+from urllib3.exceptions import NotOpenSSLWarning
+warnings.filterwarnings("ignore", category=NotOpenSSLWarning)
+
+# Configuration
+BASE_URL = "http://localhost:8080"
+DEFAULT_ENDPOINT = "/api/convert"
+STREAM_ENDPOINT = "/api/convert/stream"
+BENCHMARK_DIR = os.path.join(os.path.dirname(__file__), "benchmark")
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "replay_results.csv")
+TIMEOUT = 300
+PERCENTILES = [0.5, 0.9, 0.95, 0.99]
+
+def load_trace(trace_file):
+    """Read the JSON-lines trace written by flask/traffic_capture.py, ordered by arrival."""
+    entries = []
+    with open(trace_file) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return sorted(entries, key=lambda e: e['arrival'])
+
+def index_files(archive_dir=None, fallback_dir=None):
+    """
+    Map sha256 -> file path.  Archived uploads are already named by hash;
+    files in the fallback directory (e.g. the benchmark set) are hashed.
+    """
+    index = {}
+    if fallback_dir and os.path.isdir(fallback_dir):
+        for path in glob.glob(os.path.join(fallback_dir, "**", "*.svg"), recursive=True):
+            with open(path, 'rb') as f:
+                index[hashlib.sha256(f.read()).hexdigest()] = path
+    if archive_dir and os.path.isdir(archive_dir):
+        for path in glob.glob(os.path.join(archive_dir, "*.svg")):
+            index[os.path.splitext(os.path.basename(path))[0]] = path
+    return index
+
+def request_url(entry, base_url=BASE_URL, url=None):
+    """URL to replay an entry against: `url` if given, else the captured endpoint on base_url."""
+    if url:
+        return url
+    return base_url.rstrip('/') + (entry.get('endpoint') or DEFAULT_ENDPOINT)
+
+def _stream_status(response):
+    """Status code carried by the final 'result' event of a JSON-lines progress stream."""
+    status_code = None
+    for line in response.iter_lines():
+        if line.strip():
+            event = json.loads(line)
+            if event.get('stage') == 'result':
+                status_code = event.get('status_code')
+    return status_code
+
+def send_request(url, entry, filepath):
+    """Replay one captured request and time it (streamed conversions until their result event)."""
+    speed = entry.get('speed') or 155
+    filename = entry.get('filename') or os.path.basename(filepath)
+    stream = url.endswith(STREAM_ENDPOINT)
+    start_time = time.time()
+    try:
+        with open(filepath, 'rb') as f:
+            response = requests.post(
+                url,
+                files={'svg_file': (filename, f, 'image/svg+xml')},
+                data={'speed': str(speed)},
+                params={'format': 'jsonl'} if stream else None,
+                stream=stream,
+                timeout=TIMEOUT
+            )
+        status_code = response.status_code
+        if stream and status_code == 200:
+            status_code = _stream_status(response)
+    except requests.exceptions.Timeout:
+        status_code = None
+    except Exception:
+        status_code = None
+    return {
+        'sha256': entry.get('sha256'),
+        'endpoint': entry.get('endpoint') or DEFAULT_ENDPOINT,
+        'size_kb': (entry.get('size') or 0) / 1024,
+        'captured_status': entry.get('status'),
+        'captured_latency': entry.get('latency'),
+        'status_code': status_code,
+        'latency': time.time() - start_time,
+    }
+
+def replay(entries, index, base_url=BASE_URL, url=None, scale=1.0, max_workers=64):
+    """
+    Issue each request at its captured offset from the first arrival,
+    multiplied by `scale` (0.5 replays twice as fast, 0 fires as fast as possible),
+    to the endpoint it was captured on (or to `url` for all of them).
+    """
+    results = []
+    results_lock = threading.Lock()
+    skipped = 0
+
+    def run(entry, filepath):
+        result = send_request(request_url(entry, base_url, url), entry, filepath)
+        with results_lock:
+            results.append(result)
+
+    first_arrival = entries[0]['arrival'] if entries else 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for entry in entries:
+            filepath = index.get(entry.get('sha256'))
+            if not filepath:
+                skipped += 1
+                continue
+            due = (entry['arrival'] - first_arrival) * scale
+            delay = due - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, entry, filepath)
+
+    if skipped:
+        print(f"Skipped {skipped} requests whose upload was not found in the archive")
+    return pd.DataFrame(results)
+
+def summarize(df):
+    """Print replayed vs captured latency distributions."""
+    if df.empty:
+        print("No requests were replayed")
+        return
+    rows = {}
+    for column, label in (('captured_latency', 'captured'), ('latency', 'replayed')):
+        series = df[column].dropna()
+        stats = {f"p{int(p * 100)}": series.quantile(p) for p in PERCENTILES}
+        stats['max'] = series.max()
+        stats['mean'] = series.mean()
+        stats['count'] = len(series)
+        rows[label] = stats
+    print("\nLatency (seconds):")
+    print(pd.DataFrame(rows).T.round(3))
+    if df['endpoint'].nunique() > 1:
+        print("\nReplayed latency by endpoint (seconds):")
+        print(df.groupby('endpoint')['latency'].describe(percentiles=PERCENTILES).round(3))
+    print("\nStatus codes (captured vs replayed):")
+    print(pd.DataFrame({
+        'captured': df['captured_status'].value_counts(dropna=False),
+        'replayed': df['status_code'].value_counts(dropna=False),
+    }).fillna(0).astype(int))
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a captured conversion traffic trace against a server')
+    parser.add_argument('trace', help='Trace file written with TRAFFIC_CAPTURE_FILE')
+    parser.add_argument('--archive', help='Directory of archived uploads (TRAFFIC_CAPTURE_ARCHIVE)')
+    parser.add_argument('--fallback-dir', default=BENCHMARK_DIR,
+                        help='Directory searched by content hash for uploads missing from the archive')
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help='Server to replay against; each request goes to the endpoint it was captured on')
+    parser.add_argument('--url', help='Send every request to this one endpoint instead')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply captured inter-arrival times by this factor (0 = no delay)')
+    parser.add_argument('--workers', type=int, default=64, help='Maximum concurrent in-flight requests')
+    parser.add_argument('--output', default=RESULTS_FILE, help='CSV file for per-request results')
+
+    args = parser.parse_args()
+
+    entries = load_trace(args.trace)
+    if not entries:
+        print(f"Error: trace is empty: {args.trace}")
+        return 1
+    index = index_files(args.archive, args.fallback_dir)
+
+    span = entries[-1]['arrival'] - entries[0]['arrival']
+    print(f"Replaying {len(entries)} requests captured over {span:.1f}s at scale {args.scale}")
+    results = replay(entries, index, base_url=args.base_url, url=args.url, scale=args.scale,
+                     max_workers=args.workers)
+    summarize(results)
+
+    if not results.empty:
+        results.to_csv(args.output, index=False)
+        print(f"Results saved to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
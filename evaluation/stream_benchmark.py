@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Compare G-code streaming protocols against the simulated GRBL controller
+
+import os
+import sys
+import glob
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask'))
+
+from gcode_streamer import GcodeStreamer, TTYPort, order_layers
+from grbl_simulator import GrblSimulator, DEFAULT_BAUD, DEFAULT_LATENCY, RX_BUFFER_SIZE
+
+MODES = [('character-counting', False), ('send-and-wait', True)]
+
+
+def run_mode(layers, send_and_wait, args):
+    """Stream the job once through a fresh simulator; returns the streamer report merged with simulator stats."""
+    with GrblSimulator(rx_buffer=args.rx_buffer, baud=args.baud, time_scale=args.time_scale,
+                       latency=args.latency) as sim:
+        port = TTYPort(sim.port_path, args.baud)
+        try:
+            streamer = GcodeStreamer(port, args.rx_buffer, send_and_wait)
+            streamer.wake(settle=0.2)
+            report = streamer.stream_job(layers)
+        finally:
+            port.close()
+        report.update(sim.stats)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark G-code streaming against a simulated controller')
+    parser.add_argument('paths', nargs='+', help='Layer .gcode files or result folders')
+    parser.add_argument('--baud', type=int, default=DEFAULT_BAUD, help='Simulated serial speed')
+    parser.add_argument('--rx-buffer', type=int, default=RX_BUFFER_SIZE, help='Controller receive buffer')
+    parser.add_argument('--time-scale', type=float, default=0.05,
+                        help='Motion time multiplier (1 = real time; lower runs the benchmark faster)')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help='Seconds each controller reply takes to reach the host')
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.gcode'))) if os.path.isdir(path) else [path])
+    layers = order_layers(files)
+    if not layers:
+        print("Error: no G-code files given")
+        return 1
+
+    print(f"{len(layers)} layers, {args.baud} baud, {args.rx_buffer}-byte RX buffer, "
+          f"{args.latency * 1000:g} ms reply latency, time scale {args.time_scale}")
+    header = f"{'mode':<20} {'lines':>7} {'seconds':>8} {'lines/s':>8} {'mean buf':>9} {'max rx':>7} " \
+             f"{'overflows':>9} {'starved s':>9} {'motion s':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, send_and_wait in MODES:
+        r = run_mode(layers, send_and_wait, args)
+        print(f"{name:<20} {r['lines']:>7} {r['seconds']:>8.2f} {r['lines_per_second']:>8.1f} "
+              f"{r['mean_buffered']:>9.1f} {r['max_rx']:>7} {r['overflows']:>9} "
+              f"{r['starved_seconds']:>9.2f} {r['motion_seconds']:>9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import os
+import math
+import multiprocessing
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import metrics
+
+# Fast lane: cost units a worker process converts concurrently, how many
+# requests may queue for a slot, and how long one may wait before it is turned away.
+ADMISSION_SLOTS = int(os.environ.get('ADMISSION_SLOTS', 2))
+ADMISSION_QUEUE_LIMIT = int(os.environ.get('ADMISSION_QUEUE_LIMIT', 4))
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 10))
+
+# Heavy lane: separate, smaller pool that additionally limits how many
+# heavy jobs may start per minute.
+HEAVY_LANE_SLOTS = int(os.environ.get('HEAVY_LANE_SLOTS', 1))
+HEAVY_LANE_QUEUE_LIMIT = int(os.environ.get('HEAVY_LANE_QUEUE_LIMIT', 2))
+HEAVY_LANE_MAX_WAIT = float(os.environ.get('HEAVY_LANE_MAX_WAIT', 30))
+HEAVY_LANE_RATE_PER_MINUTE = float(os.environ.get('HEAVY_LANE_RATE_PER_MINUTE', 6))
+
+# Batch lane: whole batch requests, each of which fans out over several processes
+BATCH_LANE_SLOTS = int(os.environ.get('BATCH_LANE_SLOTS', 1))
+BATCH_LANE_QUEUE_LIMIT = int(os.environ.get('BATCH_LANE_QUEUE_LIMIT', 1))
+BATCH_LANE_MAX_WAIT = float(os.environ.get('BATCH_LANE_MAX_WAIT', 30))
+# Parallel conversion processes per admitted batch.  Each may use up to
+# SVG_PROCESSING_MAX_RSS_MB, so the batch lane can hold
+# BATCH_LANE_SLOTS x BATCH_WORKERS x SVG_PROCESSING_MAX_RSS_MB per worker
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 2))
+
+# gunicorn worker processes (gunicorn.conf.py), each with its own lanes
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Requests one worker admits at once (running or queued) and conversions it
+# may run at once; gunicorn.conf.py and tiling.py size themselves from these
+ADMISSION_CAPACITY = (ADMISSION_SLOTS + ADMISSION_QUEUE_LIMIT + HEAVY_LANE_SLOTS + HEAVY_LANE_QUEUE_LIMIT +
+                      BATCH_LANE_SLOTS + BATCH_LANE_QUEUE_LIMIT)
+MAX_CONVERSIONS = ADMISSION_SLOTS + HEAVY_LANE_SLOTS + BATCH_LANE_SLOTS * BATCH_WORKERS
+
+# One cost unit per this many estimated seconds of conversion work
+SECONDS_PER_UNIT = 5
+
+
+def estimate_cost(preflight, slots=ADMISSION_SLOTS):
+    """Cost of a job in slots from its preflight estimate (1 for icons, more for large art)."""
+    units = 1 + int(preflight['estimated_seconds'] // SECONDS_PER_UNIT)
+    return max(1, min(units, slots))
+
+
+class AdmissionRejected(Exception):
+    """The request could not be admitted; the client should retry later."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Weighted, bounded FIFO admission.  A request holding `cost` units runs
+    once that many of `slots` units are free and every earlier request has
+    been admitted; at most `queue_limit` requests wait, each for at most
+    `max_wait` seconds.  Excess work is rejected immediately.  With
+    `rate_per_minute` set, admissions are also spaced by a token bucket.
+    """
+
+    def __init__(self, name, slots=ADMISSION_SLOTS, queue_limit=ADMISSION_QUEUE_LIMIT,
+                 max_wait=ADMISSION_MAX_WAIT, rate_per_minute=None):
+        self.name = name
+        self.slots = slots
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.rate = rate_per_minute / 60.0 if rate_per_minute else None
+        self._tokens = float(slots)
+        self._refilled = time.monotonic()
+        self.in_use = 0
+        self.running = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        # Moving average of seconds a unit of cost is held, for Retry-After
+        self._avg_hold = 1.0
+        metrics.register_collector(self._gauges)
+
+    def _gauges(self):
+        with self._cond:
+            return {
+                f'admission_{self.name}_queue_depth': len(self._queue),
+                f'admission_{self.name}_running': self.running,
+                f'admission_{self.name}_slots_in_use': self.in_use,
+                f'admission_{self.name}_slots': self.slots,
+            }
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained."""
+        backlog = self.in_use + len(self._queue)
+        wait = self._avg_hold * backlog / max(self.slots, 1)
+        if self.rate is not None:
+            wait = max(wait, (len(self._queue) + 1) / self.rate)
+        return max(1, math.ceil(wait))
+
+    def _token_wait(self):
+        """Seconds until an admission token is available (0 when not rate limited)."""
+        if self.rate is None:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(float(self.slots), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def _reject(self, message):
+        metrics.incr(f'admission_{self.name}_rejected')
+        raise AdmissionRejected(message, self.retry_after())
+
+    def acquire(self, cost):
+        cost = max(1, min(cost, self.slots))
+        with self._cond:
+            if not self._queue and self.in_use + cost <= self.slots and not self._token_wait():
+                self._admit(cost, 0.0)
+                return cost
+            if len(self._queue) >= self.queue_limit:
+                self._reject('Server is busy, admission queue is full')
+            ticket = object()
+            self._queue.append(ticket)
+            enqueued = time.monotonic()
+            deadline = enqueued + self.max_wait
+            try:
+                while True:
+                    token_wait = 0.0
+                    if self._queue[0] is ticket and self.in_use + cost <= self.slots:
+                        token_wait = self._token_wait()
+                        if not token_wait:
+                            break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('Server is busy, timed out waiting for a conversion slot')
+                    self._cond.wait(min(remaining, token_wait) if token_wait else remaining)
+            finally:
+                self._queue.remove(ticket)
+                # The next request in line may fit now
+                self._cond.notify_all()
+            self._admit(cost, time.monotonic() - enqueued)
+            return cost
+
+    def _admit(self, cost, waited):
+        if self.rate is not None:
+            self._tokens -= 1
+        self.in_use += cost
+        self.running += 1
+        metrics.incr(f'admission_{self.name}_admitted')
+        metrics.set_gauge(f'admission_{self.name}_last_wait_seconds', round(waited, 3))
+
+    def release(self, cost, held_seconds):
+        with self._cond:
+            self.in_use -= cost
+            self.running -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * (held_seconds / cost)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost):
+        """Hold `cost` slots for the duration of the block (raises AdmissionRejected)."""
+        cost = self.acquire(cost)
+        start = time.monotonic()
+        try:
+            yield cost
+        finally:
+            self.release(cost, time.monotonic() - start)
@@ -1,109 +1,222 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 import os
+import json
 import uuid
+import queue
+import threading
 import traceback
 import time
-import shutil
+import mimetypes
 from datetime import datetime
-from functools import wraps
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from zipfile import ZipFile
-from threading import Thread
-from svg_utils import (
-    convert_svg_to_gcode,
-    convert_svg_to_png,
-    split_svg_by_color,
-    convert_svg_to_separated_gcode
+import metrics
+from admission import (
+    AdmissionController,
+    AdmissionRejected,
+    estimate_cost,
+    HEAVY_LANE_SLOTS,
+    HEAVY_LANE_QUEUE_LIMIT,
+    HEAVY_LANE_MAX_WAIT,
+    HEAVY_LANE_RATE_PER_MINUTE,
+    BATCH_LANE_SLOTS,
+    BATCH_LANE_QUEUE_LIMIT,
+    BATCH_LANE_MAX_WAIT
+)
+from preflight import scan_svg
+from progress import ConversionProgress, HEARTBEAT_SECONDS
+from session_janitor import start_janitor, touch_session
+from artifacts import content_etag, precompressed_variant, ARTIFACT_MAX_AGE, store as artifact_store
+from compression import zip_options, describe_zip
+from batch import BatchError, collect_batch_inputs, convert_batch, write_batch_archive
+from xml.etree.ElementTree import ParseError
+from traffic_capture import capture_traffic, capture_stream
+from request_profiler import profiling_requested
+from conversion import run_conversion
+from conversion_budget import (
+    run_with_budget,
+    BudgetExceeded,
+    ConversionError,
+    SVG_PROCESSING_TIMEOUT,
+    SVG_PROCESSING_MAX_RSS_MB
 )
-
-# Timeout decorator to limit long-running operations
-# (Kept if you want to use it for future route timeouts)
-def timeout(seconds):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            result = [TimeoutError("Function timed out")]
-            def target():
-                try:
-                    result[0] = func(*args, **kwargs)
-                except Exception as e:
-                    result[0] = e
-            thread = Thread(target=target)
-            thread.daemon = True
-            thread.start()
-            thread.join(seconds)
-            if isinstance(result[0], Exception):
-                raise result[0]
-            return result[0]
-        return wrapper
-    return decorator
 
 app = Flask(__name__)
 CORS(app)
-UPLOAD_FOLDER = 'static/uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-SVG_PROCESSING_TIMEOUT = 30
+# Session artifacts go through the artifact store (a local folder or a
+# shared filesystem, see artifacts.py); with ARTIFACT_STORE=shared any
+# node can serve a download converted on another
+os.makedirs(artifact_store.sessions_root, exist_ok=True)
+# Keep a copy of the original upload in the session folder (conversion itself works from memory)
+SAVE_ORIGINAL_UPLOAD = os.environ.get('SAVE_ORIGINAL_UPLOAD', '1').lower() in ('1', 'true', 'yes')
+# Small jobs and heavy jobs wait for separate slot pools, so a large
+# artwork never holds up the icons queued behind it
+admission_lanes = {
+    'fast': AdmissionController('fast'),
+    'heavy': AdmissionController('heavy', slots=HEAVY_LANE_SLOTS, queue_limit=HEAVY_LANE_QUEUE_LIMIT,
+                                 max_wait=HEAVY_LANE_MAX_WAIT, rate_per_minute=HEAVY_LANE_RATE_PER_MINUTE),
+    'batch': AdmissionController('batch', slots=BATCH_LANE_SLOTS, queue_limit=BATCH_LANE_QUEUE_LIMIT,
+                                 max_wait=BATCH_LANE_MAX_WAIT),
+}
+
+@app.before_request
+def ensure_janitor():
+    # Started lazily so it runs in each serving process, not in the
+    # preloading gunicorn master or in conversion workers
+    start_janitor(artifact_store.sessions_root, app.logger)
+
+def overloaded_response(e, preflight=None):
+    response = jsonify({'success': False, 'error': 'overloaded', 'message': str(e), 'retry_after': e.retry_after,
+                        'preflight': preflight})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
 
 @app.route('/api/convert', methods=['POST'])
+@capture_traffic
 def convert():
+    upload, error = read_upload()
+    if error:
+        return error
+    filename, svg_data, preflight, speed = upload
+    lane = admission_lanes[preflight['lane']]
+    cost = estimate_cost(preflight, lane.slots)
+    try:
+        with lane.admit(cost):
+            body, status = convert_upload(filename, svg_data, preflight, speed, profiling_requested())
+            return jsonify(body), status
+    except AdmissionRejected as e:
+        app.logger.warning(f"Rejected {preflight['lane']} conversion (cost {cost}): {e}")
+        return overloaded_response(e, preflight)
+
+@app.route('/api/convert/stream', methods=['POST'])
+def convert_stream():
+    """
+    Same as /api/convert, but answers immediately with a stream of progress
+    events (Server-Sent Events, or JSON lines with ?format=jsonl) ending in
+    a 'result' event that carries the usual response body and status code.
+    """
+    # Recorded when the result event is sent, not when the stream opens
+    record = capture_stream()
+    upload, error = read_upload()
+    if error:
+        if record:
+            record(error[1], error[0].get_json())
+        return error
+    filename, svg_data, preflight, speed = upload
+    profile = profiling_requested()
+    events = queue.Queue()
+    progress = ConversionProgress(events.put)
+    progress.start('upload')
+    progress.done('upload', bytes=len(svg_data), preflight=preflight)
+
+    def work():
+        lane = admission_lanes[preflight['lane']]
+        cost = estimate_cost(preflight, lane.slots)
+        try:
+            progress.start('queue', lane=preflight['lane'])
+            with lane.admit(cost):
+                progress.done('queue')
+                body, status = convert_upload(filename, svg_data, preflight, speed, profile, progress)
+        except AdmissionRejected as e:
+            app.logger.warning(f"Rejected {preflight['lane']} conversion (cost {cost}): {e}")
+            body, status = {'success': False, 'error': 'overloaded', 'message': str(e),
+                            'retry_after': e.retry_after, 'preflight': preflight}, 429
+        except Exception as e:
+            app.logger.error(f"Error in streamed conversion: {e}")
+            body, status = {'success': False, 'message': f'Internal server error during conversion: {e}'}, 500
+        events.put({'stage': 'result', 'status_code': status, 'percent': 100 if status == 200 else progress.percent(),
+                    'elapsed': round(time.monotonic() - progress.started, 3), 'timings': progress.timings,
+                    'result': body})
+        # before the stream closes, so the trace is complete once the client has the result
+        if record:
+            record(status, body)
+        events.put(None)
+
+    # The conversion keeps running (and holds its admission slot) if the client goes away
+    threading.Thread(target=work, daemon=True).start()
+    jsonl = request.args.get('format') == 'jsonl'
+
+    def stream():
+        while True:
+            try:
+                event = events.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield '\n' if jsonl else ': keep-alive\n\n'
+                continue
+            if event is None:
+                return
+            data = json.dumps(event)
+            if jsonl:
+                yield data + '\n'
+            else:
+                name = 'result' if event['stage'] == 'result' else 'progress'
+                yield f'event: {name}\ndata: {data}\n\n'
+
+    response = Response(stream(), mimetype='application/x-ndjson' if jsonl else 'text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx-style proxies not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def read_speed():
+    """(speed, None) from the form, else (None, error response) when it is not an integer."""
+    try:
+        return int(request.form.get('speed', 155)), None
+    except ValueError:
+        return None, (jsonify({'success': False, 'message': 'Speed must be an integer (mm/min)'}), 400)
+
+def read_upload():
+    """((filename, svg_data, preflight, speed), None) for a valid upload, else (None, error response)."""
     if 'svg_file' not in request.files:
-        return jsonify({'success': False, 'message': 'No file part'}), 400
+        return None, (jsonify({'success': False, 'message': 'No file part'}), 400)
     file = request.files['svg_file']
     if file.filename == '':
-        return jsonify({'success': False, 'message': 'No selected file'}), 400
+        return None, (jsonify({'success': False, 'message': 'No selected file'}), 400)
     if not file.filename.lower().endswith('.svg'):
-        return jsonify({'success': False, 'message': 'File must be an SVG'}), 400
+        return None, (jsonify({'success': False, 'message': 'File must be an SVG'}), 400)
+    speed, error = read_speed()
+    if error:
+        return None, error
+    # Cheap preflight scan sizes the job and picks its lane before any conversion work
+    # The request body is read exactly once; everything downstream shares this buffer
+    svg_data = file.read()
+    try:
+        preflight = scan_svg(svg_data)
+    except ParseError as e:
+        return None, (jsonify({'success': False, 'message': f'Invalid SVG: {e}'}), 400)
+    return (file.filename, svg_data, preflight, speed), None
+
+def convert_upload(original_filename, svg_data, preflight, speed, profile=False, progress=None):
+    """Convert and package one upload; returns (response body, status code)."""
     start_time = time.time()
     session_id = str(uuid.uuid4())
-    session_folder = os.path.join(UPLOAD_FOLDER, session_id)
-    os.makedirs(session_folder, exist_ok=True)
-    processing_timeout = 30
+    session_folder = artifact_store.workspace(session_id)
     try:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(session_folder, filename)
-        file.save(filepath)
-        speed = int(request.form.get('speed', 155))
-        png_file = convert_svg_to_png(filepath, session_folder, app.logger)
-        app.logger.info("Converting SVG to G-code and separating by color")
-        detected_colors, gcode_files_dict = convert_svg_to_separated_gcode(filepath, speed, session_folder, app.logger)
-        if not gcode_files_dict:
-            app.logger.info("Falling back to color-splitting method")
-            svg_layers = split_svg_by_color(filepath, session_folder, app.logger)
-            if not svg_layers:
-                shutil.rmtree(session_folder, ignore_errors=True)
-                return jsonify({'success': False, 'message': 'No valid color layers found in SVG. Please check your SVG file has valid paths and color information.'}), 400
-            gcode_files = []
-            try:
-                from multiprocessing import Pool
-                from functools import partial
-                process_color = partial(convert_svg_to_gcode, speed=speed, output_folder=session_folder, app_logger=app.logger)
-                color_paths = [(svg_path, color) for color, svg_path in svg_layers.items()]
-                with Pool() as pool:
-                    results = pool.starmap(process_color, color_paths)
-                gcode_files = [f for f in results if f]
-            except (ImportError, OSError):
-                for color, svg_path in svg_layers.items():
-                    gcode_file = convert_svg_to_gcode(svg_path, color, speed, session_folder, app.logger)
-                    if gcode_file:
-                        gcode_files.append(gcode_file)
-        else:
-            if isinstance(gcode_files_dict, dict):
-                gcode_files = list(gcode_files_dict.values())
-                app.logger.info(f"Generated G-code files for colors: {list(gcode_files_dict.keys())}")
-            else:
-                app.logger.warning("gcode_files_dict is not a dictionary. Using empty list.")
-                gcode_files = []
-                gcode_files_dict = {}
+        filename = secure_filename(original_filename)
+        if SAVE_ORIGINAL_UPLOAD:
+            with open(os.path.join(session_folder, filename), 'wb') as f:
+                f.write(svg_data)
+        # Conversion runs in a killable worker process with time and memory limits
+        # layers are zipped by the conversion process as they finish
+        zip_filename = f'files-{datetime.now().strftime("%Y%m%d%H%M%S")}.zip'
+        zip_filepath = os.path.join(session_folder, zip_filename)
+        result = run_with_budget(run_conversion, (svg_data, filename, speed, session_folder),
+                                 {'profile': profile, 'archive_path': zip_filepath},
+                                 timeout=SVG_PROCESSING_TIMEOUT, max_rss_mb=SVG_PROCESSING_MAX_RSS_MB,
+                                 on_progress=progress.update if progress else None)
+        if result.get('no_layers'):
+            artifact_store.discard(session_id, session_folder)
+            return {'success': False, 'message': 'No valid color layers found in SVG. Please check your SVG file has valid paths and color information.'}, 400
+        gcode_files = result['gcode_files']
+        colors = result['colors']
         if gcode_files:
             end_time = time.time()
             processing_time = round(end_time - start_time, 2)
-            zip_filename = f'files-{datetime.now().strftime("%Y%m%d%H%M%S")}.zip'
-            zip_filepath = os.path.join(session_folder, zip_filename)
-            with ZipFile(zip_filepath, 'w') as zipf:
-                zipf.write(png_file, os.path.basename(png_file))
-                for gcode_file in gcode_files:
-                    zipf.write(gcode_file, os.path.basename(gcode_file))
+            zip_start = time.time()
+            if progress:
+                progress.start('zip')
+            with ZipFile(zip_filepath, 'a', **zip_options()) as zipf:
                 info_file = os.path.join(session_folder, 'processing_info.txt')
                 with open(info_file, 'w') as f:
                     f.write(f"Processing information:\n")
@@ -112,46 +225,135 @@ def convert():
                     f.write(f"- Speed setting: {speed} mm/min\n")
                     f.write(f"- Processed on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
                     f.write(f"- Total layers: {len(gcode_files)}\n")
-                    if isinstance(gcode_files_dict, dict) and gcode_files_dict:
-                        f.write(f"- Colors: {list(gcode_files_dict.keys())}\n")
-                    elif 'svg_layers' in locals() and svg_layers:
-                        f.write(f"- Colors: {list(svg_layers.keys())}\n") 
-                    else:
-                        f.write(f"- Colors: ['black']\n")
+                    f.write(f"- Colors: {colors}\n")
+                    f.write(f"- Archive compression: {describe_zip(zipf, result.get('archive_seconds', 0) + time.time() - zip_start)}\n")
+                    layer_stats = result.get('layer_stats', {})
+                    if layer_stats.get('duplicates_removed'):
+                        f.write(f"- Duplicate paths removed: {layer_stats['duplicates_removed']}\n")
+                    if layer_stats.get('clipped'):
+                        f.write(f"- Out-of-bounds paths skipped: {layer_stats['clipped'].get('culled', 0)}\n")
+                        f.write(f"- Out-of-bounds curves: {layer_stats['clipped'].get('dropped', 0)} dropped, "
+                                f"{layer_stats['clipped'].get('clipped', 0)} clipped\n")
+                    if layer_stats.get('reused'):
+                        f.write(f"- Reused unchanged layers: {layer_stats['reused']}\n")
+                    estimate = result.get('estimate')
+                    if estimate:
+                        total = estimate['total']
+                        f.write(f"- Estimated machine time: {total['seconds'] / 60:.1f} min "
+                                f"({total['draw_mm']} mm drawn, {total['travel_mm']} mm travel, "
+                                f"{total['pen_lifts']} pen lifts)\n")
+                        for color, layer in estimate['layers'].items():
+                            f.write(f"  - {color}: {layer['seconds'] / 60:.1f} min, {layer['draw_mm']} mm drawn, "
+                                    f"{layer['travel_mm']} mm travel, {layer['pen_lifts']} pen lifts\n")
+                    for gz in result.get('gzip_stats', []):
+                        f.write(f"- Gzip {gz['file']}: {gz['size']} -> {gz['gz_size']} bytes in {gz['seconds']} seconds\n")
                 zipf.write(info_file, os.path.basename(info_file))
-            return jsonify({
-                'success': True, 
+            artifact_store.publish(session_id, session_folder)
+            if progress:
+                progress.done('zip')
+            return {
+                'success': True,
                 'download_url': f'/api/download/{session_id}/{zip_filename}',
                 'processing_time': processing_time,
-                'colors': list(gcode_files_dict.keys()) if isinstance(gcode_files_dict, dict) and gcode_files_dict 
-                          else list(svg_layers.keys()) if 'svg_layers' in locals() and svg_layers 
-                          else ['black']
-            })
+                'colors': colors,
+                'reused_layers': result.get('layer_stats', {}).get('reused', []),
+                'duplicates_removed': sum(result.get('layer_stats', {}).get('duplicates_removed', {}).values()),
+                'out_of_bounds': result.get('layer_stats', {}).get('clipped', {}),
+                'estimate': result.get('estimate'),
+                'preflight': preflight
+            }, 200
         else:
-            shutil.rmtree(session_folder, ignore_errors=True)
-            return jsonify({'success': False, 'message': 'Error generating G-code. The SVG file may not contain valid path elements.'}), 400
-    except Exception as e:
-        if 'cairosvg.surface.PNGSurface' in str(e.__class__):
-            shutil.rmtree(session_folder, ignore_errors=True)
-            app.logger.error(f"Error converting SVG to PNG: {e}")
-            app.logger.error(traceback.format_exc())
-            return jsonify({'success': False, 'message': f'Error rendering SVG: {str(e)}. The SVG file may contain unsupported features.'}), 400
+            artifact_store.discard(session_id, session_folder)
+            return {'success': False, 'message': 'Error generating G-code. The SVG file may not contain valid path elements.'}, 400
+    except BudgetExceeded as e:
+        artifact_store.discard(session_id, session_folder)
+        app.logger.warning(f"Conversion cancelled ({e.error}): {e}")
+        return {'success': False, 'error': e.error, 'limit': e.limit, 'message': str(e)}, e.status_code
     except Exception as e:
-        shutil.rmtree(session_folder, ignore_errors=True)
+        artifact_store.discard(session_id, session_folder)
+        error_class = e.error_class if isinstance(e, ConversionError) else str(e.__class__)
         app.logger.error(f"Error in conversion process: {e}")
-        app.logger.error(traceback.format_exc())
-        return jsonify({'success': False, 'message': f'Internal server error during conversion: {str(e)}'}), 500
+        app.logger.error(e.traceback if isinstance(e, ConversionError) else traceback.format_exc())
+        if 'cairosvg.surface.PNGSurface' in error_class:
+            return {'success': False, 'message': f'Error rendering SVG: {str(e)}. The SVG file may contain unsupported features.'}, 400
+        return {'success': False, 'message': f'Internal server error during conversion: {str(e)}'}, 500
+
+@app.route('/api/convert/batch', methods=['POST'])
+def convert_batch_endpoint():
+    uploads = [f for f in request.files.getlist('svg_files') + request.files.getlist('archive') if f.filename]
+    if not uploads:
+        return jsonify({'success': False, 'message': 'No files in batch'}), 400
+    try:
+        items = collect_batch_inputs(uploads)
+    except BatchError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    speed, error = read_speed()
+    if error:
+        return error
+    try:
+        with admission_lanes['batch'].admit(1):
+            start_time = time.time()
+            session_id = str(uuid.uuid4())
+            session_folder = artifact_store.workspace(session_id)
+            jobs = convert_batch(items, speed, session_folder, app.logger)
+            processing_time = round(time.time() - start_time, 2)
+            if not any(job.get('success') for job in jobs):
+                artifact_store.discard(session_id, session_folder)
+                return jsonify({'success': False, 'message': 'No file in the batch could be converted',
+                                'files': [{'file': n, 'message': job.get('message')}
+                                          for job in jobs for n in job['names']]}), 400
+            zip_filename = f'batch-{datetime.now().strftime("%Y%m%d%H%M%S")}.zip'
+            report = write_batch_archive(os.path.join(session_folder, zip_filename), jobs, speed, processing_time)
+            artifact_store.publish(session_id, session_folder)
+            return jsonify({
+                'success': True,
+                'download_url': f'/api/download/{session_id}/{zip_filename}',
+                'processing_time': processing_time,
+                'unique_files': len(jobs),
+                'files': report
+            })
+    except AdmissionRejected as e:
+        app.logger.warning(f"Rejected batch of {len(items)} files: {e}")
+        return overloaded_response(e)
+
+@app.route('/api/metrics')
+def metrics_endpoint():
+    return jsonify({'pid': os.getpid(), **metrics.snapshot()})
+
+@app.route('/api/health')
+def health():
+    return jsonify({'success': True, 'pid': os.getpid()})
 
 @app.route('/api/download/<session_id>/<filename>')
 def download_file(session_id, filename):
-    filepath = os.path.join(UPLOAD_FOLDER, session_id, filename)
-    if not os.path.exists(filepath):
+    session_id = secure_filename(session_id)
+    filepath = artifact_store.path(session_id, secure_filename(filename))
+    if not filepath:
         return jsonify({'success': False, 'message': 'File not found'}), 404
+    filepath = os.path.abspath(filepath)
+    touch_session(artifact_store.session_dir(session_id))
     try:
-        return send_file(filepath, as_attachment=True)
+        # Strong content ETag + conditional=True gives 304s for repeat
+        # downloads and 206 Range responses for resumed transfers
+        etag = content_etag(filepath)
+        gz_path = precompressed_variant(filepath)
+        if gz_path and 'Range' not in request.headers and 'gzip' in request.accept_encodings:
+            response = send_file(gz_path, as_attachment=True, download_name=os.path.basename(filepath),
+                                 mimetype=mimetypes.guess_type(filepath)[0] or 'application/octet-stream',
+                                 etag=f'{etag}-gzip', conditional=True, max_age=ARTIFACT_MAX_AGE)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_file(filepath, as_attachment=True, etag=etag, conditional=True,
+                                 max_age=ARTIFACT_MAX_AGE)
+        if gz_path:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        return response
     except Exception as e:
         app.logger.error(f"Error sending file {filename}: {e}")
         return jsonify({'success': False, 'message': 'Error sending file'}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
+    # Development server only; production runs gunicorn (see gunicorn.conf.py)
+    debug = os.environ.get('FLASK_DEBUG', '1').lower() in ('1', 'true', 'yes')
+    app.run(host='0.0.0.0', port=8080, debug=debug)
@@ -0,0 +1,207 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Session artifacts are never modified after a conversion finishes, so
+# clients and proxies may cache them indefinitely.
+ARTIFACT_MAX_AGE = int(os.environ.get('ARTIFACT_MAX_AGE', 365 * 24 * 3600))
+PRECOMPRESSED_SUFFIX = '.gz'
+# Where session artifacts live: 'local' keeps them in ARTIFACT_ROOT on this
+# node; 'shared' expects ARTIFACT_ROOT on a filesystem mounted by every
+# node (NFS, EFS, ...) so any node can serve any download
+ARTIFACT_STORE = os.environ.get('ARTIFACT_STORE', 'local').lower()
+ARTIFACT_ROOT = os.environ.get('ARTIFACT_ROOT', 'static/uploads')
+# Node-local space conversions write to before publishing to a shared store
+ARTIFACT_SCRATCH_DIR = os.environ.get('ARTIFACT_SCRATCH_DIR', os.path.join(tempfile.gettempdir(), 'cncweb-work'))
+# Unreferenced objects and abandoned workspaces younger than this are kept
+# (an object is unreferenced for a moment between being stored and linked)
+ARTIFACT_GC_GRACE_SECONDS = int(os.environ.get('ARTIFACT_GC_GRACE_SECONDS', 3600))
+
+_ETAG_CACHE_SIZE = 4096
+_etag_cache = OrderedDict()
+_etag_lock = threading.Lock()
+
+
+def content_etag(path):
+    """
+    Strong ETag (sha256 of the content) for an artifact.  Hashes are cached
+    per (path, size, mtime), so each file is read at most once per process.
+    """
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _etag_lock:
+        etag = _etag_cache.get(key)
+        if etag is not None:
+            _etag_cache.move_to_end(key)
+            return etag
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+    with _etag_lock:
+        _etag_cache[key] = etag
+        if len(_etag_cache) > _ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def precompressed_variant(path):
+    """Path of a gzip-compressed copy of `path`, if one was produced."""
+    gz_path = path + PRECOMPRESSED_SUFFIX
+    return gz_path if os.path.isfile(gz_path) else None
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalArtifactStore:
+    """
+    Session artifacts in ARTIFACT_ROOT/<session_id>/ on this node.
+    Conversions write straight into the session folder, so publishing is
+    free; downloads only work on the node that converted.  The default,
+    and a stand-in for the shared store in tests.
+    """
+
+    def __init__(self, root=ARTIFACT_ROOT):
+        self.root = root
+        self.sessions_root = root
+
+    def workspace_root(self):
+        return self.root
+
+    def session_dir(self, session_id):
+        return os.path.join(self.sessions_root, session_id)
+
+    def workspace(self, session_id):
+        """Node-local folder a conversion writes its files to."""
+        path = os.path.join(self.workspace_root(), session_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def publish(self, session_id, workspace):
+        """Make the top-level files of a finished workspace downloadable."""
+
+    def discard(self, session_id, workspace):
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    def path(self, session_id, name):
+        """Local path of a published artifact, or None."""
+        path = os.path.join(self.session_dir(session_id), name)
+        return path if os.path.isfile(path) else None
+
+    def cache_dir(self, name, default):
+        """Directory for a derived-data cache (e.g. layer_cache); shared stores share it between nodes."""
+        return default
+
+    def collect_garbage(self, grace=ARTIFACT_GC_GRACE_SECONDS):
+        return 0, 0
+
+
+class SharedArtifactStore(LocalArtifactStore):
+    """
+    Session artifacts on a filesystem every node mounts.  Each file is
+    stored once under objects/ by its sha256 and hard-linked into
+    sessions/<session_id>/, so identical layers from repeated uploads take
+    the space of one.  Every write is a temp file renamed into place, so
+    readers on other nodes never see a partial file.  Conversions run in
+    a node-local workspace and are published when complete.
+    """
+
+    def __init__(self, root=ARTIFACT_ROOT, scratch=ARTIFACT_SCRATCH_DIR):
+        super().__init__(root)
+        self.sessions_root = os.path.join(root, 'sessions')
+        self.objects_root = os.path.join(root, 'objects')
+        self.scratch = scratch
+
+    def workspace_root(self):
+        return self.scratch
+
+    def put_object(self, src):
+        """Store a file's content (once) and return the object path."""
+        digest = file_sha256(src)
+        obj = os.path.join(self.objects_root, digest[:2], digest)
+        if os.path.exists(obj):
+            # refreshed so garbage collection cannot race this new reference
+            os.utime(obj)
+            return obj
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        tmp_path = f'{obj}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copyfile(src, tmp_path)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, obj)
+        return obj
+
+    def _link(self, obj, dest):
+        tmp_path = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.link(obj, tmp_path)
+        except OSError:
+            # filesystems without hard links still work, without dedupe
+            shutil.copyfile(obj, tmp_path)
+        os.replace(tmp_path, dest)
+
+    def publish(self, session_id, workspace):
+        target = self.session_dir(session_id)
+        os.makedirs(target, exist_ok=True)
+        for entry in sorted(os.scandir(workspace), key=lambda e: e.name):
+            if entry.is_file(follow_symlinks=False):
+                self._link(self.put_object(entry.path), os.path.join(target, entry.name))
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    def discard(self, session_id, workspace):
+        shutil.rmtree(workspace, ignore_errors=True)
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+
+    def cache_dir(self, name, default):
+        return os.path.join(self.root, 'cache', name)
+
+    def collect_garbage(self, grace=ARTIFACT_GC_GRACE_SECONDS):
+        """
+        Remove objects no session links to any more (link count 1) and
+        workspaces abandoned by crashed conversions; returns (files, bytes).
+        """
+        cutoff = time.time() - grace
+        removed = removed_bytes = 0
+        if os.path.isdir(self.objects_root):
+            for shard in os.scandir(self.objects_root):
+                if not shard.is_dir(follow_symlinks=False):
+                    continue
+                for entry in os.scandir(shard.path):
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        if st.st_nlink == 1 and st.st_mtime < cutoff:
+                            os.remove(entry.path)
+                            removed += 1
+                            removed_bytes += st.st_size
+                    except OSError:
+                        continue
+        if os.path.isdir(self.scratch):
+            for entry in os.scandir(self.scratch):
+                try:
+                    if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                except OSError:
+                    continue
+        return removed, removed_bytes
+
+
+def open_store(kind=ARTIFACT_STORE, root=ARTIFACT_ROOT):
+    if kind == 'local':
+        return LocalArtifactStore(root)
+    if kind == 'shared':
+        return SharedArtifactStore(root)
+    raise ValueError(f"Unknown ARTIFACT_STORE: {kind!r} (expected 'local' or 'shared')")
+
+
+store = open_store()
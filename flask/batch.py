@@ -0,0 +1,176 @@
+import os
+import io
+import json
+import time
+import hashlib
+import posixpath
+from zipfile import ZipFile, BadZipFile
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import ParseError
+from werkzeug.utils import secure_filename
+from preflight import scan_svg
+from conversion import run_conversion
+from conversion_budget import run_with_budget, BudgetExceeded, ConversionError
+from compression import zip_options
+from admission import BATCH_WORKERS
+
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 200))
+BATCH_MAX_TOTAL_MB = int(os.environ.get('BATCH_MAX_TOTAL_MB', 100))
+
+BATCH_REPORT_TXT = 'batch_report.txt'
+BATCH_REPORT_JSON = 'batch_report.json'
+
+
+class BatchError(Exception):
+    """The batch request itself is unusable (nothing converted)."""
+
+
+def _add_input(items, name, data, total):
+    if len(items) >= BATCH_MAX_FILES:
+        raise BatchError(f'Too many files in batch (limit {BATCH_MAX_FILES})')
+    total += len(data)
+    if total > BATCH_MAX_TOTAL_MB * 1024 * 1024:
+        raise BatchError(f'Batch exceeds {BATCH_MAX_TOTAL_MB} MB')
+    items.append((name, data))
+    return total
+
+
+def collect_batch_inputs(uploads):
+    """
+    (name, bytes) for every SVG in the uploaded files; .zip uploads are
+    expanded, keeping their internal directory layout in the name.
+    """
+    items = []
+    total = 0
+    for upload in uploads:
+        lower = upload.filename.lower()
+        if lower.endswith('.svg'):
+            total = _add_input(items, upload.filename, upload.read(), total)
+        elif lower.endswith('.zip'):
+            try:
+                with ZipFile(io.BytesIO(upload.read())) as archive:
+                    for info in archive.infolist():
+                        name = info.filename
+                        if info.is_dir() or not name.lower().endswith('.svg') or name.startswith('__MACOSX/'):
+                            continue
+                        if total + info.file_size > BATCH_MAX_TOTAL_MB * 1024 * 1024:
+                            raise BatchError(f'Batch exceeds {BATCH_MAX_TOTAL_MB} MB')
+                        total = _add_input(items, name, archive.read(info), total)
+            except BadZipFile:
+                raise BatchError(f'{upload.filename} is not a valid zip archive')
+    if not items:
+        raise BatchError('No SVG files found in batch')
+    return items
+
+
+def output_dir_name(name, used):
+    """Per-file directory in the result archive: sanitised path without .svg, made unique."""
+    parts = [secure_filename(p) for p in posixpath.normpath(name.replace('\\', '/')).split('/')]
+    parts = [p for p in parts if p]
+    stem = '/'.join(parts)[:-len('.svg')] if parts else 'file'
+    candidate = stem or 'file'
+    n = 2
+    while candidate in used:
+        candidate = f'{stem}-{n}'
+        n += 1
+    used.add(candidate)
+    return candidate
+
+
+def _convert_one(job, speed, session_folder):
+    job_folder = os.path.join(session_folder, job['sha256'][:16])
+    os.makedirs(job_folder, exist_ok=True)
+    start = time.time()
+    try:
+        result = run_with_budget(run_conversion, (job['data'], secure_filename(job['names'][0]) or 'upload.svg',
+                                                  speed, job_folder))
+        if result.get('no_layers') or not result['gcode_files']:
+            job.update(success=False, message='No valid color layers found in SVG')
+        else:
+            job.update(success=True, png_file=result['png_file'], gcode_files=result['gcode_files'],
+                       colors=result['colors'])
+    except BudgetExceeded as e:
+        job.update(success=False, error=e.error, message=str(e))
+    except ConversionError as e:
+        job.update(success=False, message=str(e))
+    job['processing_time'] = round(time.time() - start, 2)
+    return job
+
+
+def convert_batch(items, speed, session_folder, app_logger=None):
+    """
+    Convert every distinct input (by sha256) in parallel budgeted worker
+    processes.  Returns one entry per unique input with all its names.
+    """
+    jobs = {}
+    for name, data in items:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in jobs:
+            jobs[digest]['names'].append(name)
+            continue
+        job = {'sha256': digest, 'names': [name], 'data': data}
+        try:
+            job['preflight'] = scan_svg(data)
+        except ParseError as e:
+            job.update(success=False, message=f'Invalid SVG: {e}')
+        jobs[digest] = job
+
+    pending = [job for job in jobs.values() if 'success' not in job]
+    # Longest first, so one large file does not start last and set the batch latency
+    pending.sort(key=lambda job: job['preflight']['estimated_seconds'], reverse=True)
+    if app_logger:
+        app_logger.info(f"Batch: {len(items)} files, {len(jobs)} unique, converting {len(pending)} "
+                        f"with {BATCH_WORKERS} workers")
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_WORKERS)) as executor:
+        list(executor.map(lambda job: _convert_one(job, speed, session_folder), pending))
+    for job in jobs.values():
+        job.pop('data', None)
+    return list(jobs.values())
+
+
+def write_batch_archive(zip_filepath, jobs, speed, processing_time):
+    """One folder per input file plus a combined text and JSON report; returns the per-file report."""
+    used = set()
+    report = []
+    with ZipFile(zip_filepath, 'w', **zip_options()) as zipf:
+        for job in jobs:
+            for i, name in enumerate(job['names']):
+                entry = {
+                    'file': name,
+                    'sha256': job['sha256'],
+                    'success': job.get('success', False),
+                    'colors': job.get('colors', []),
+                    'processing_time': job.get('processing_time'),
+                    'preflight': job.get('preflight'),
+                }
+                if i:
+                    entry['duplicate_of'] = job['names'][0]
+                if not entry['success']:
+                    entry['message'] = job.get('message')
+                    report.append(entry)
+                    continue
+                folder = output_dir_name(name, used)
+                entry['folder'] = folder
+                for path in [job['png_file']] + job['gcode_files']:
+                    zipf.write(path, f"{folder}/{os.path.basename(path)}")
+                report.append(entry)
+
+        converted = sum(1 for job in jobs if job.get('success'))
+        lines = [
+            "Batch processing information:",
+            f"- Files received: {sum(len(job['names']) for job in jobs)}",
+            f"- Unique inputs: {len(jobs)}",
+            f"- Converted: {converted}",
+            f"- Failed: {len(jobs) - converted}",
+            f"- Processing time: {processing_time} seconds",
+            f"- Speed setting: {speed} mm/min",
+            "",
+        ]
+        for entry in report:
+            status = 'ok' if entry['success'] else f"failed: {entry.get('message')}"
+            duplicate = f" (duplicate of {entry['duplicate_of']})" if 'duplicate_of' in entry else ''
+            lines.append(f"{entry['file']}: {status}{duplicate}, colors {entry['colors']}, "
+                         f"{entry['processing_time']} s")
+        zipf.writestr(BATCH_REPORT_TXT, '\n'.join(lines) + '\n')
+        zipf.writestr(BATCH_REPORT_JSON, json.dumps(report, indent=2))
+    return report
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# Convert whole directory trees of SVG files to G-code without the web stack
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import signal
+import hashlib
+import logging
+import argparse
+import multiprocessing
+import layer_cache
+from svg_utils import convert_svg_to_separated_gcode, convert_svg_to_png, load_svg_root
+
+MANIFEST_FILE = '.bulk_manifest.jsonl'
+PARTIAL_SUFFIX = '.partial'
+DEFAULT_SPEED = 155
+# Per-file limit; an overnight run should not stall on one pathological file
+DEFAULT_TIMEOUT = 600
+# Recycle pool processes now and then so parser/compiler garbage does not accumulate
+TASKS_PER_CHILD = 50
+
+logger = logging.getLogger('bulk_convert')
+
+
+class FileTimeout(BaseException):
+    """Raised by SIGALRM; not an Exception, so the per-layer error handling in svg_utils cannot swallow it."""
+
+
+def _on_alarm(signum, frame):
+    raise FileTimeout()
+
+
+def _init_worker(log_level):
+    signal.signal(signal.SIGALRM, _on_alarm)
+    # Ctrl-C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level, format='%(processName)s %(levelname)s %(message)s')
+
+
+def iter_svg_files(src):
+    """Relative paths of all .svg files below src, yielded lazily in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith('.svg'):
+                yield os.path.relpath(os.path.join(dirpath, name), src)
+
+
+def output_dir_for(dst, rel_path):
+    """Mirrored layout: src/a/b/logo.svg -> dst/a/b/logo/."""
+    return os.path.join(dst, os.path.splitext(rel_path)[0])
+
+
+def load_manifest(dst):
+    """Latest manifest entry per relative path (the file is append-only, last line wins)."""
+    entries = {}
+    try:
+        with open(os.path.join(dst, MANIFEST_FILE)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line from an interrupted run
+                    continue
+                entries[entry['path']] = entry
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def compact_manifest(dst, entries):
+    """Rewrite the manifest with one line per file."""
+    path = os.path.join(dst, MANIFEST_FILE)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry) + '\n')
+    os.replace(tmp_path, path)
+
+
+def _has_result(entry, out_dir):
+    """A recorded failure, or a conversion whose outputs are still on disk."""
+    return entry is not None and (entry.get('status') == 'failed' or os.path.isdir(out_dir))
+
+
+def _is_current(entry, st, out_dir):
+    """Unchanged since the last run according to size and mtime (no read needed)."""
+    return (_has_result(entry, out_dir) and entry.get('size') == st.st_size
+            and entry.get('mtime_ns') == st.st_mtime_ns)
+
+
+def convert_file(task):
+    """
+    Pool worker: read one SVG, skip it if its content hash matches the
+    manifest, otherwise convert it into a scratch directory and swap that
+    into place, so an interrupted run never leaves half-written outputs.
+    """
+    rel_path, src_path, out_dir, known_sha256, speed, png, timeout = task
+    start = time.time()
+    with open(src_path, 'rb') as f:
+        data = f.read()
+    st = os.stat(src_path)
+    entry = {
+        'path': rel_path,
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+    }
+    if entry['sha256'] == known_sha256:
+        entry['status'] = 'unchanged'
+        return entry
+
+    for stale in glob.glob(glob.escape(out_dir) + PARTIAL_SUFFIX + '-*'):
+        shutil.rmtree(stale, ignore_errors=True)
+    scratch = f'{out_dir}{PARTIAL_SUFFIX}-{os.getpid()}'
+    os.makedirs(scratch)
+    try:
+        signal.alarm(timeout)
+        try:
+            if png:
+                convert_svg_to_png(src_path, scratch, logger, svg_data=data)
+            stats = {}
+            detected, gcode_files = convert_svg_to_separated_gcode(load_svg_root(data), speed, scratch, logger,
+                                                                   stats=stats)
+        finally:
+            # cancelled before any handler runs, so it cannot fire inside one
+            signal.alarm(0)
+        if not gcode_files:
+            raise ValueError('No valid color layers found in SVG')
+        if stats.get('failed'):
+            # a partial result would be recorded as converted and never retried
+            raise ValueError(f"G-code generation failed for layers: {', '.join(stats['failed'])}")
+    except FileTimeout:
+        shutil.rmtree(scratch, ignore_errors=True)
+        entry.update(status='failed', error=f'timed out after {timeout} seconds')
+        return entry
+    except Exception as e:
+        shutil.rmtree(scratch, ignore_errors=True)
+        entry.update(status='failed', error=f'{type(e).__name__}: {e}')
+        return entry
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(scratch, out_dir)
+    entry.update(status='converted', colors=list(gcode_files.keys()),
+                 outputs=sorted(os.listdir(out_dir)), seconds=round(time.time() - start, 2))
+    return entry
+
+
+def iter_tasks(src, dst, manifest, args, counts):
+    """Conversion tasks for changed files; files unchanged by size and mtime are skipped here."""
+    for rel_path in iter_svg_files(src):
+        src_path = os.path.join(src, rel_path)
+        out_dir = output_dir_for(dst, rel_path)
+        entry = manifest.get(rel_path)
+        if entry is not None and entry.get('status') == 'failed' and args.retry_failed:
+            entry = None
+        if not args.checksum and _is_current(entry, os.stat(src_path), out_dir):
+            counts['skipped'] += 1
+            continue
+        known = entry['sha256'] if _has_result(entry, out_dir) else None
+        yield (rel_path, src_path, out_dir, known, args.speed, args.png, args.timeout)
+
+
+def run(src, dst, args):
+    os.makedirs(dst, exist_ok=True)
+    manifest = load_manifest(dst)
+    counts = {'converted': 0, 'unchanged': 0, 'failed': 0, 'skipped': 0}
+    start = time.time()
+    pool = multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(args.log_level,),
+                                maxtasksperchild=TASKS_PER_CHILD)
+    interrupted = False
+    try:
+        with open(os.path.join(dst, MANIFEST_FILE), 'a') as log:
+            results = pool.imap_unordered(convert_file, iter_tasks(src, dst, manifest, args, counts),
+                                          chunksize=args.chunksize)
+            for entry in results:
+                status = entry['status']
+                counts[status] += 1
+                if status == 'unchanged':
+                    # Keep the earlier result, refresh size/mtime for the fast check next time
+                    entry = {**manifest[entry['path']], 'size': entry['size'], 'mtime_ns': entry['mtime_ns']}
+                manifest[entry['path']] = entry
+                log.write(json.dumps(entry) + '\n')
+                log.flush()
+                if status == 'converted':
+                    print(f"converted {entry['path']} ({', '.join(entry['colors'])}) in {entry['seconds']}s")
+                elif status == 'failed':
+                    print(f"FAILED    {entry['path']}: {entry['error']}")
+        pool.close()
+    except KeyboardInterrupt:
+        interrupted = True
+        pool.terminate()
+        print("Interrupted; rerun the same command to resume")
+    finally:
+        pool.join()
+
+    if not interrupted:
+        compact_manifest(dst, manifest)
+    # No janitor runs outside the web app, so keep the layer cache bounded here
+    removed, removed_bytes = layer_cache.prune(args.layer_cache_max_mb)
+    if removed:
+        print(f"Pruned {removed} layer cache entries ({removed_bytes / 1024 / 1024:.1f} MB)")
+    elapsed = time.time() - start
+    print(f"{counts['converted']} converted, {counts['failed']} failed, "
+          f"{counts['skipped'] + counts['unchanged']} unchanged in {elapsed:.1f}s")
+    return 1 if counts['failed'] or interrupted else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a directory tree of SVG files to G-code')
+    parser.add_argument('src', help='Directory searched recursively for .svg files')
+    parser.add_argument('dst', help='Output directory; gets one folder per SVG in the same layout')
+    parser.add_argument('--speed', type=int, default=DEFAULT_SPEED, help='Movement speed in mm/min')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Conversion processes')
+    parser.add_argument('--chunksize', type=int, default=4, help='Files handed to a process at a time')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT,
+                        help='Seconds allowed per file (0 = no limit)')
+    parser.add_argument('--png', action='store_true', help='Also render original.png previews')
+    parser.add_argument('--checksum', action='store_true',
+                        help='Hash every file instead of trusting unchanged size and mtime')
+    parser.add_argument('--retry-failed', action='store_true', help='Retry files that failed in earlier runs')
+    parser.add_argument('--layer-cache', default=layer_cache.LAYER_CACHE_DIR,
+                        help='Directory of compiled layers reused across runs and with the web app')
+    parser.add_argument('--no-layer-cache', action='store_true', help='Do not read or fill the layer cache')
+    parser.add_argument('--layer-cache-max-mb', type=int, default=layer_cache.LAYER_CACHE_MAX_MB,
+                        help='Prune the layer cache to this size after the run')
+    parser.add_argument('--verbose', action='store_true', help='Log conversion details')
+
+    args = parser.parse_args()
+    args.log_level = logging.INFO if args.verbose else logging.WARNING
+    # Set before the pool starts, so workers see it whether they are forked or spawned
+    layer_cache.LAYER_CACHE_DIR = os.environ['LAYER_CACHE_DIR'] = \
+        '' if args.no_layer_cache or not args.layer_cache else os.path.abspath(args.layer_cache)
+
+    if not os.path.isdir(args.src):
+        print(f"Error: not a directory: {args.src}")
+        return 1
+    src = os.path.abspath(args.src)
+    dst = os.path.abspath(args.dst)
+    if dst == src or dst.startswith(src + os.sep):
+        print("Error: output directory must not be inside the source directory")
+        return 1
+    return run(src, dst, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
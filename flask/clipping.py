@@ -0,0 +1,205 @@
+import os
+import re
+from svg_to_gcode.geometry import Line, LineSegmentChain, Vector
+from svg_to_gcode.svg_parser import Transformation
+from dedupe import path_bbox
+
+# Printable area of the machine in G-code units (mm); 0 leaves that axis unbounded
+BED_WIDTH = float(os.environ.get('BED_WIDTH', 0))
+BED_HEIGHT = float(os.environ.get('BED_HEIGHT', 0))
+# Drop geometry the SVG viewBox (or width/height) crops away
+CLIP_TO_VIEWBOX = os.environ.get('CLIP_TO_VIEWBOX', '1').lower() in ('1', 'true', 'yes')
+
+_NUMBER_RE = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([a-z]*)\s*$')
+_EPSILON = 1e-9
+
+
+def parse_length(value):
+    """Number of user units in a width/height attribute; None for percentages or garbage."""
+    m = _NUMBER_RE.match(value or '')
+    return float(m.group(1)) if m else None
+
+
+def clip_bounds(root):
+    """
+    (xmin, ymin, xmax, ymax) in G-code coordinates that geometry must lie
+    in: the viewport the SVG shows intersected with the machine bed, or
+    None when nothing constrains it.  svg_to_gcode maps user coordinates
+    straight to machine units, flipping y about the root height, and so
+    does this.
+    """
+    height = parse_length(root.get('height'))
+    if height is None:
+        return None
+    xmin = ymin = float('-inf')
+    xmax = ymax = float('inf')
+    if CLIP_TO_VIEWBOX:
+        viewbox = (root.get('viewBox') or '').replace(',', ' ').split()
+        width = parse_length(root.get('width'))
+        if len(viewbox) == 4:
+            try:
+                vx, vy, vw, vh = (float(v) for v in viewbox)
+            except ValueError:
+                vx = vy = vw = vh = None
+            if vw is not None and vw > 0 and vh > 0:
+                xmin, xmax = vx, vx + vw
+                ymin, ymax = height - (vy + vh), height - vy
+        elif width is not None:
+            xmin, xmax = 0.0, width
+            ymin, ymax = 0.0, height
+    if BED_WIDTH > 0:
+        xmin, xmax = max(xmin, 0.0), min(xmax, BED_WIDTH)
+    if BED_HEIGHT > 0:
+        ymin, ymax = max(ymin, 0.0), min(ymax, BED_HEIGHT)
+    if (xmin, ymin, xmax, ymax) == (float('-inf'), float('-inf'), float('inf'), float('inf')):
+        return None
+    return xmin, ymin, xmax, ymax
+
+
+def curve_bbox(curve):
+    """
+    Bounding box of a curve from its defining points (a Bezier lies inside
+    the hull of its control points); None when it cannot be bounded cheaply.
+    """
+    name = type(curve).__name__
+    if name == 'Line':
+        points = (curve.start, curve.end)
+    elif name == 'CubicBazier':
+        points = (curve.start, curve.end, curve.control1, curve.control2)
+    elif name == 'QuadraticBezier':
+        points = (curve.start, curve.end, curve.control)
+    else:
+        return None
+    xs = [p.x for p in points]
+    ys = [p.y for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def classify(bbox, rect):
+    """'inside', 'outside' or 'partial' for a bounding box against a clip rectangle."""
+    if bbox is None:
+        return 'partial'
+    x0, y0, x1, y1 = bbox
+    xmin, ymin, xmax, ymax = rect
+    if x0 >= xmin - _EPSILON and x1 <= xmax + _EPSILON and y0 >= ymin - _EPSILON and y1 <= ymax + _EPSILON:
+        return 'inside'
+    if x1 < xmin or x0 > xmax or y1 < ymin or y0 > ymax:
+        return 'outside'
+    return 'partial'
+
+
+def element_bbox(elem, canvas_height):
+    """
+    Bounding box of a <path> element in G-code coordinates, from its points
+    and its own transform, without parsing it into curves; None when it
+    cannot be bounded cheaply (arcs, unparseable transforms).
+    """
+    bbox = path_bbox(elem.get('d', ''))
+    if bbox is None:
+        return None
+    x0, y0, x1, y1 = bbox
+    transform = elem.get('transform')
+    if transform:
+        transformation = Transformation()
+        try:
+            transformation.add_transform(transform)
+        except (ValueError, KeyError, TypeError):
+            return None
+        # an affine map sends the box to the parallelogram spanned by its corners
+        corners = [transformation.apply_affine_transformation(Vector(x, y)) for x in (x0, x1) for y in (y0, y1)]
+        x0, x1 = min(c.x for c in corners), max(c.x for c in corners)
+        y0, y1 = min(c.y for c in corners), max(c.y for c in corners)
+    return x0, canvas_height - y1, x1, canvas_height - y0
+
+
+def cull_layers(layers, root):
+    """
+    Drop path elements that lie wholly outside clip_bounds(root) from
+    {color: [path elements]} before anything parses them.  Elements that
+    cross the boundary are kept and cut curve by curve in clip_curves.
+    Returns ({color: kept}, number of elements dropped).
+    """
+    rect = clip_bounds(root)
+    canvas_height = parse_length(root.get('height'))
+    if rect is None or canvas_height is None:
+        return layers, 0
+    result = {}
+    dropped = 0
+    for color, elems in layers.items():
+        kept = [e for e in elems if classify(element_bbox(e, canvas_height), rect) != 'outside']
+        dropped += len(elems) - len(kept)
+        result[color] = kept
+    return result, dropped
+
+
+def clip_segment(x0, y0, x1, y1, rect):
+    """Liang–Barsky: parameter range (t0, t1) of the segment inside rect, or None."""
+    xmin, ymin, xmax, ymax = rect
+    dx = x1 - x0
+    dy = y1 - y0
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+        if p == 0:
+            if q < -_EPSILON:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+    return t0, t1
+
+
+def _clip_chain(chain, rect):
+    """Pieces of a line-segment approximation inside rect as continuous chains, and whether anything was cut."""
+    pieces = []
+    current = None
+    cut = False
+    for line in chain:
+        a, b = line.start, line.end
+        span = clip_segment(a.x, a.y, b.x, b.y, rect)
+        if span is None or span[1] - span[0] <= _EPSILON:
+            current = None
+            cut = True
+            continue
+        t0, t1 = span
+        cut = cut or t0 > 0 or t1 < 1
+        start = a if t0 <= 0 else a + (b - a) * t0
+        end = b if t1 >= 1 else a + (b - a) * t1
+        if current is None or t0 > 0:
+            current = LineSegmentChain()
+            pieces.append(current)
+        current.append(Line(start, end))
+        if t1 < 1:
+            current = None
+    return pieces, cut
+
+
+def clip_curves(curves, rect, stats=None):
+    """
+    Yield what the compiler should draw: curves entirely inside rect as
+    they are, and the inside pieces of the others as LineSegmentChains.
+    Curves are classified by their bounding box first, so only those
+    crossing the boundary are approximated and clipped segment by segment.
+    `stats` counts dropped and clipped curves.
+    """
+    for curve in curves:
+        where = classify(curve_bbox(curve), rect)
+        if where == 'inside':
+            yield curve
+            continue
+        if where == 'outside':
+            if stats is not None:
+                stats['dropped'] = stats.get('dropped', 0) + 1
+            continue
+        chain = LineSegmentChain.line_segment_approximation(curve)
+        pieces, cut = _clip_chain(chain, rect)
+        if stats is not None and cut:
+            key = 'clipped' if pieces else 'dropped'
+            stats[key] = stats.get(key, 0) + 1
+        yield from pieces
@@ -0,0 +1,117 @@
+import os
+import gzip
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED, ZIP_LZMA
+
+# Result archive compression: 'stored', 'deflate' or 'lzma'
+ARCHIVE_COMPRESSION = os.environ.get('ARCHIVE_COMPRESSION', 'deflate').lower()
+# deflate only, 0-9.  zipfile always writes LZMA entries with the default
+# preset and has no way to pass another, so lzma takes no level.
+ARCHIVE_COMPRESSION_LEVEL = int(os.environ.get('ARCHIVE_COMPRESSION_LEVEL', 6))
+# Also write <color>.gcode.gz next to each layer (served to gzip-capable clients)
+GZIP_GCODE = os.environ.get('GZIP_GCODE', '').lower() in ('1', 'true', 'yes')
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+
+ZIP_METHODS = {
+    'stored': ZIP_STORED,
+    'deflate': ZIP_DEFLATED,
+    'lzma': ZIP_LZMA,
+}
+
+
+def zip_options():
+    """Keyword arguments for ZipFile according to ARCHIVE_COMPRESSION."""
+    method = ZIP_METHODS.get(ARCHIVE_COMPRESSION, ZIP_DEFLATED)
+    options = {'compression': method}
+    if method == ZIP_DEFLATED:
+        options['compresslevel'] = ARCHIVE_COMPRESSION_LEVEL
+    return options
+
+
+def describe_zip(zipf, seconds):
+    """One-line summary of an archive's size/time trade-off for processing_info.txt."""
+    raw = sum(info.file_size for info in zipf.infolist())
+    packed = sum(info.compress_size for info in zipf.infolist())
+    ratio = f"{packed / raw:.1%}" if raw else "n/a"
+    method = ARCHIVE_COMPRESSION if ARCHIVE_COMPRESSION in ZIP_METHODS else 'deflate'
+    level = {'deflate': f" level {ARCHIVE_COMPRESSION_LEVEL}", 'lzma': " (default preset)"}.get(method, '')
+    return f"{method}{level}, {raw} -> {packed} bytes ({ratio}) in {seconds:.3f} seconds"
+
+
+def gzip_file(path, level=GZIP_LEVEL):
+    """Write path + '.gz' and return its size/time statistics."""
+    start = time.time()
+    gz_path = path + '.gz'
+    with open(path, 'rb') as src, gzip.open(gz_path, 'wb', compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return {
+        'file': os.path.basename(path),
+        'size': os.path.getsize(path),
+        'gz_size': os.path.getsize(gz_path),
+        'seconds': round(time.time() - start, 3),
+    }
+
+
+class LayerCompressor:
+    """
+    Gzips finished layers on background threads while later layers are
+    still compiling (zlib releases the GIL).  Use as a context manager;
+    `stats` is filled in when the block exits.
+    """
+
+    def __init__(self, level=GZIP_LEVEL, max_workers=2):
+        self.level = level
+        self.stats = []
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, color, gcode_path):
+        self._futures.append(self._executor.submit(gzip_file, gcode_path, self.level))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._executor.shutdown(wait=True)
+        if exc_type is None:
+            self.stats = [f.result() for f in self._futures]
+        return False
+
+
+class LayerArchiver:
+    """
+    Writes finished layers into the result archive on a background thread
+    while later layers are still compiling (zlib and lzma release the GIL).
+    Use as a context manager; the archive is closed, and `seconds` holds the
+    time spent compressing, when the block exits.  Further entries can be
+    appended afterwards with ZipFile(path, 'a').
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seconds = 0.0
+        self._zipf = ZipFile(path, 'w', **zip_options())
+        self._futures = []
+        # one thread: ZipFile entries are written one after another
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _write(self, path):
+        start = time.time()
+        self._zipf.write(path, os.path.basename(path))
+        self.seconds += time.time() - start
+
+    def submit(self, color, path):
+        self._futures.append(self._executor.submit(self._write, path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._executor.shutdown(wait=True)
+        self._zipf.close()
+        if exc_type is None:
+            for future in self._futures:
+                future.result()
+        return False
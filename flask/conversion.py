@@ -0,0 +1,113 @@
+import logging
+from contextlib import nullcontext, ExitStack
+from svg_utils import (
+    convert_svg_to_gcode,
+    convert_svg_to_png,
+    split_svg_by_color,
+    convert_svg_to_separated_gcode,
+    load_svg_root
+)
+from request_profiler import RequestProfiler
+from progress import report_progress
+from palette import DEFAULT_PEN
+from machine_time import estimate_layers
+from compression import LayerCompressor, LayerArchiver, GZIP_GCODE
+import text_outline
+
+logger = logging.getLogger('conversion')
+
+# Built once in the forkserver rather than in every conversion process
+text_outline.preload()
+
+
+def run_conversion(svg_data, filename, speed, session_folder, profile=False, archive_path=None):
+    """
+    The CPU-heavy part of /api/convert: PNG preview plus per-colour G-code,
+    falling back to the legacy colour-splitting method.  Runs inside a
+    budgeted worker process (see conversion_budget.run_with_budget), so the
+    result only contains picklable paths, colour names and statistics.
+
+    `svg_data` is the upload as read from the request; it is parsed once
+    and the same tree feeds bucketing, compilation and the fallbacks.
+    With `archive_path`, the preview and every layer are written into that
+    zip while later layers compile; result['archive_seconds'] is the time
+    spent compressing them.
+    """
+    with RequestProfiler(session_folder, logger) if profile else nullcontext():
+        with ExitStack() as stack:
+            sinks = []
+            compressor = archiver = None
+            if GZIP_GCODE:
+                compressor = stack.enter_context(LayerCompressor())
+                sinks.append(compressor.submit)
+            if archive_path:
+                archiver = stack.enter_context(LayerArchiver(archive_path))
+                sinks.append(archiver.submit)
+
+            def on_layer(color, gcode_path):
+                for sink in sinks:
+                    sink(color, gcode_path)
+
+            result = _convert(svg_data, filename, speed, session_folder, on_layer if sinks else None)
+            if archiver and result.get('gcode_files'):
+                archiver.submit(None, result['png_file'])
+        if compressor:
+            result['gzip_stats'] = compressor.stats
+        if archiver:
+            result['archive_seconds'] = archiver.seconds
+        return result
+
+
+def _convert(svg_data, filename, speed, session_folder, on_layer=None):
+    """on_layer(color, gcode_path) is called for every G-code layer written."""
+    report_progress('preview', 'start')
+    png_file = convert_svg_to_png(filename, session_folder, logger, svg_data=svg_data)
+    report_progress('preview', 'done')
+    report_progress('parse', 'start')
+    root = load_svg_root(svg_data)
+    report_progress('parse', 'done')
+    logger.info("Converting SVG to G-code and separating by color")
+    layer_stats = {}
+    detected_colors, gcode_files_dict = convert_svg_to_separated_gcode(
+        root, speed, session_folder, logger, on_layer=on_layer, on_progress=report_progress, stats=layer_stats)
+    if gcode_files_dict:
+        logger.info(f"Generated G-code files for colors: {list(gcode_files_dict.keys())}")
+        return {
+            'png_file': png_file,
+            'gcode_files': list(gcode_files_dict.values()),
+            'colors': list(gcode_files_dict.keys()),
+            'layer_stats': layer_stats,
+            'estimate': estimate_layers(gcode_files_dict, speed),
+        }
+
+    logger.info("Falling back to color-splitting method")
+    svg_layers = split_svg_by_color(root, session_folder, logger)
+    if not svg_layers:
+        return {'png_file': png_file, 'gcode_files': [], 'colors': [], 'no_layers': True}
+    gcode_files = {}
+    report_progress('layers', 'start', weights={color: 1 for color in svg_layers})
+    try:
+        from multiprocessing import Pool
+        from functools import partial
+        process_color = partial(convert_svg_to_gcode, speed=speed, output_folder=session_folder, app_logger=logger)
+        color_paths = [(svg_path, color) for color, svg_path in svg_layers.items()]
+        with Pool() as pool:
+            results = pool.starmap(process_color, color_paths)
+        gcode_files = {color: f for color, f in zip(svg_layers, results) if f}
+        if on_layer:
+            for color, gcode_file in gcode_files.items():
+                on_layer(color, gcode_file)
+    except (ImportError, OSError):
+        for color, svg_path in svg_layers.items():
+            gcode_file = convert_svg_to_gcode(svg_path, color, speed, session_folder, logger)
+            if gcode_file:
+                gcode_files[color] = gcode_file
+                if on_layer:
+                    on_layer(color, gcode_file)
+    report_progress('layers', 'done', layers=len(gcode_files))
+    return {
+        'png_file': png_file,
+        'gcode_files': list(gcode_files.values()),
+        'colors': list(svg_layers.keys()) or [DEFAULT_PEN],
+        'estimate': estimate_layers(gcode_files, speed),
+    }
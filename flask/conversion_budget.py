@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import signal
+import logging
+import traceback
+import multiprocessing
+from progress import set_progress_sink
+
+# Wall-clock and memory budget for a single conversion (memory is the PSS
+# of the worker and everything it started, see process_tree_memory)
+SVG_PROCESSING_TIMEOUT = int(os.environ.get('SVG_PROCESSING_TIMEOUT', 30))
+SVG_PROCESSING_MAX_RSS_MB = int(os.environ.get('SVG_PROCESSING_MAX_RSS_MB', 400))
+# How often the parent checks the deadline and the worker's memory
+BUDGET_POLL_INTERVAL = 0.05
+
+# forkserver keeps a small clean process around to fork conversion workers
+# from, which is safe to use from a threaded web worker (plain fork is not).
+START_METHOD = os.environ.get('CONVERSION_START_METHOD',
+                              'forkserver' if sys.platform.startswith('linux') else 'spawn')
+_context = multiprocessing.get_context(START_METHOD)
+if START_METHOD == 'forkserver':
+    _context.set_forkserver_preload(['svg_utils', 'conversion'])
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class BudgetExceeded(Exception):
+    """A conversion was cancelled for exceeding its budget."""
+    status_code = 500
+    error = 'budget_exceeded'
+
+    def __init__(self, message, limit):
+        super().__init__(message)
+        self.limit = limit
+
+
+class ConversionTimeout(BudgetExceeded):
+    status_code = 504
+    error = 'timeout'
+
+
+class ConversionMemoryExceeded(BudgetExceeded):
+    status_code = 413
+    error = 'memory_limit'
+
+
+class ConversionError(Exception):
+    """An exception raised inside the worker, re-raised in the caller."""
+
+    def __init__(self, message, error_class, tb):
+        super().__init__(message)
+        self.error_class = error_class
+        self.traceback = tb
+
+
+def _child_pids(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _process_memory(pid):
+    """
+    Proportional set size of one process in bytes: each shared page counts
+    1/n for the n processes mapping it, so pages a tile worker shares
+    copy-on-write with its conversion are not counted once per worker.
+    RSS where smaps_rollup is unavailable (kernels before 4.14).
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * _PAGE_SIZE
+
+
+def process_tree_memory(pid):
+    """Memory in bytes of `pid` and all its descendants (0 where /proc is unavailable); see _process_memory."""
+    total = 0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            total += _process_memory(p)
+        except (OSError, ValueError, IndexError):
+            continue
+        stack.extend(_child_pids(p))
+    return total
+
+
+def _kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, AttributeError):
+        proc.kill()
+
+
+def _worker(conn, func, args, kwargs, relay_progress=False):
+    # Own process group, so cancelling also kills any pool the conversion started
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO,
+                            format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+    if relay_progress:
+        set_progress_sink(lambda event: conn.send(('progress', event)))
+    try:
+        result = func(*args, **kwargs)
+        conn.send(('ok', result))
+    except BaseException as e:
+        conn.send(('error', (str(e), str(e.__class__), traceback.format_exc())))
+    finally:
+        conn.close()
+
+
+def run_with_budget(func, args=(), kwargs=None, timeout=None, max_rss_mb=None, on_progress=None):
+    """
+    Run func(*args, **kwargs) in a separate process and return its result.
+    The process (and anything it spawned) is killed when it runs longer than
+    `timeout` seconds or its memory (PSS, see process_tree_memory) exceeds `max_rss_mb`.
+    With `on_progress`, events the worker reports through
+    progress.report_progress are passed to it in the calling thread.
+
+    Raises ConversionTimeout, ConversionMemoryExceeded or ConversionError.
+    """
+    timeout = SVG_PROCESSING_TIMEOUT if timeout is None else timeout
+    max_rss_mb = SVG_PROCESSING_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+    max_rss = max_rss_mb * 1024 * 1024
+
+    parent_conn, child_conn = _context.Pipe(duplex=False)
+    proc = _context.Process(target=_worker, args=(child_conn, func, args, kwargs or {}, on_progress is not None))
+    proc.start()
+    child_conn.close()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            if parent_conn.poll(BUDGET_POLL_INTERVAL):
+                try:
+                    status, payload = parent_conn.recv()
+                except EOFError:
+                    proc.join(1)
+                    if proc.exitcode == -signal.SIGKILL:
+                        # Most likely the kernel OOM killer
+                        raise ConversionMemoryExceeded('Conversion worker was killed (out of memory)', max_rss_mb)
+                    raise ConversionError(f'Conversion worker exited unexpectedly (code {proc.exitcode})',
+                                          'WorkerDied', '')
+                if status == 'progress':
+                    on_progress(payload)
+                    continue
+                if status == 'ok':
+                    return payload
+                message, error_class, tb = payload
+                raise ConversionError(message, error_class, tb)
+            if time.monotonic() > deadline:
+                raise ConversionTimeout(f'Conversion exceeded {timeout} seconds', timeout)
+            if max_rss and process_tree_memory(proc.pid) > max_rss:
+                raise ConversionMemoryExceeded(f'Conversion exceeded {max_rss_mb} MB of memory', max_rss_mb)
+    finally:
+        if proc.is_alive():
+            _kill_group(proc)
+        proc.join()
+        parent_conn.close()
@@ -0,0 +1,203 @@
+import os
+import re
+from collections import Counter
+
+# Drop paths within a layer that trace the same geometry as an earlier one
+# (fill + stroke copies, stacked duplicates from exporters), so the plotter
+# does not draw the same line several times.
+DEDUPE_PATHS = os.environ.get('DEDUPE_PATHS', '1').lower() in ('1', 'true', 'yes')
+# Coordinates closer than this (SVG user units) count as the same point
+DEDUPE_TOLERANCE = float(os.environ.get('DEDUPE_TOLERANCE', 0.01))
+# Also drop a path from a layer when a later-drawn layer traces it again
+# (typically a coloured fill under its black outline)
+DEDUPE_ACROSS_LAYERS = os.environ.get('DEDUPE_ACROSS_LAYERS', '1').lower() in ('1', 'true', 'yes')
+
+_TOKEN_RE = re.compile(r'([MmZzLlHhVvCcSsQqTtAa])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+# Blanks out the commands whose every argument is an absolute x,y pair
+_PAIR_COMMANDS = str.maketrans('MLCSQTZ,', '        ')
+# Numbers each command consumes per repetition
+_ARITY = {'m': 2, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4, 'q': 4, 't': 2, 'z': 0}
+
+
+def path_segments(d):
+    """
+    Absolute segments ('L', p0, p1) / ('C', p0, c1, c2, p1) / ('Q', p0, c, p1)
+    of a path, or None if it uses arcs or is malformed.  Only enough of the
+    path grammar to compare geometry cheaply; svg_to_gcode's parser (with
+    its per-point matrix transforms) does the real work when compiling.
+    """
+    tokens = _TOKEN_RE.findall(d)
+    segments = []
+    x = y = start_x = start_y = 0.0
+    last_control = None
+    last_cubic = False
+    command = None
+    i = 0
+    while i < len(tokens):
+        if tokens[i][0]:
+            command = tokens[i][0]
+            i += 1
+        elif command is None:
+            return None
+        lower = command.lower()
+        if lower not in _ARITY:
+            return None
+        n = _ARITY[lower]
+        group = tokens[i:i + n]
+        if len(group) < n or any(c for c, _ in group):
+            return None
+        args = [float(v) for _, v in group]
+        i += n
+        rel = command.islower()
+        ox, oy = (x, y) if rel else (0.0, 0.0)
+        control = None
+        if lower == 'm':
+            x, y = args[0] + ox, args[1] + oy
+            start_x, start_y = x, y
+            # Further pairs after a moveto are implicit linetos
+            command = 'l' if rel else 'L'
+        elif lower == 'z':
+            if (x, y) != (start_x, start_y):
+                segments.append(('L', (x, y), (start_x, start_y)))
+            x, y = start_x, start_y
+            if i < len(tokens) and not tokens[i][0]:
+                return None
+        elif lower in ('l', 'h', 'v'):
+            if lower == 'l':
+                nx, ny = args[0] + ox, args[1] + oy
+            elif lower == 'h':
+                nx, ny = args[0] + ox, y
+            else:
+                nx, ny = x, args[0] + oy
+            segments.append(('L', (x, y), (nx, ny)))
+            x, y = nx, ny
+        elif lower in ('c', 's'):
+            if lower == 'c':
+                c1 = (args[0] + ox, args[1] + oy)
+                rest = args[2:]
+            else:
+                c1 = (2 * x - last_control[0], 2 * y - last_control[1]) if last_cubic else (x, y)
+                rest = args
+            c2 = (rest[0] + ox, rest[1] + oy)
+            end = (rest[2] + ox, rest[3] + oy)
+            segments.append(('C', (x, y), c1, c2, end))
+            control = c2
+            x, y = end
+        else:
+            if lower == 'q':
+                c = (args[0] + ox, args[1] + oy)
+                end = (args[2] + ox, args[3] + oy)
+            else:
+                c = (2 * x - last_control[0], 2 * y - last_control[1]) if last_control and not last_cubic else (x, y)
+                end = (args[0] + ox, args[1] + oy)
+            segments.append(('Q', (x, y), c, end))
+            control = c
+            x, y = end
+        last_cubic = lower in ('c', 's')
+        last_control = control
+    return segments
+
+
+def path_bbox(d):
+    """
+    (xmin, ymin, xmax, ymax) of a path's end and control points in user
+    units (the path lies inside it), or None if it uses arcs or is
+    malformed.  Paths written with absolute coordinate pairs only are read
+    straight from their numbers, without walking the commands.
+    """
+    try:
+        # any other command, or numbers run together as in '1-2', fails float()
+        numbers = [float(v) for v in d.translate(_PAIR_COMMANDS).split()]
+    except ValueError:
+        numbers = None
+    if numbers and len(numbers) % 2 == 0:
+        xs = numbers[0::2]
+        ys = numbers[1::2]
+        return min(xs), min(ys), max(xs), max(ys)
+    segments = path_segments(d)
+    if not segments:
+        return None
+    xs = [p[0] for seg in segments for p in seg[1:]]
+    ys = [p[1] for seg in segments for p in seg[1:]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _snap(segment, q):
+    return (segment[0],) + tuple((round(px / q), round(py / q)) for px, py in segment[1:])
+
+
+def path_geometry_key(elem, tolerance=DEDUPE_TOLERANCE):
+    """
+    Hashable description of what a <path> draws: absolute coordinates
+    snapped to `tolerance`, independent of how `d` is written (relative or
+    absolute commands, H/V/L, number formatting) and of direction.  Paths
+    with arcs fall back to their snapped command stream.
+    """
+    transform = ' '.join(elem.get('transform', '').split())
+    d = elem.get('d', '')
+    segments = path_segments(d)
+    if segments is None:
+        tokens = tuple(c or round(float(v) / tolerance) for c, v in _TOKEN_RE.findall(d))
+        return 'text', tokens, transform
+    # Zero-length segments (e.g. a closing Z on the start point) draw nothing
+    snapped = [s for s in (_snap(seg, tolerance) for seg in segments) if len(set(s[1:])) > 1]
+    forward = tuple(snapped)
+    backward = tuple((s[0],) + s[:0:-1] for s in reversed(snapped))
+    return 'geometry', min(forward, backward), transform
+
+
+def _raw_key(elem):
+    """The path as written, with whitespace and commas normalized."""
+    return ' '.join(elem.get('transform', '').split()), ' '.join(elem.get('d', '').replace(',', ' ').split())
+
+
+def geometry_keys(elems, tolerance=DEDUPE_TOLERANCE):
+    """
+    Dedupe key per element, as a list parallel to `elems`.  Paths written
+    identically share a key without being parsed; the rest are bucketed
+    by their snapped bounding box (equal geometry implies an equal box)
+    and only paths whose box is not unique get the full path_geometry_key.
+    Keys are only meaningful for comparing with each other.
+    """
+    raw = [_raw_key(e) for e in elems]
+    first = {}
+    for key, elem in zip(raw, elems):
+        first.setdefault(key, elem)
+    boxes = {}
+    for key in first:
+        bbox = path_bbox(key[1])
+        boxes[key] = None if bbox is None else (key[0],) + tuple(round(v / tolerance) for v in bbox)
+    shared = Counter(boxes.values())
+    keys = {}
+    for key, elem in first.items():
+        box = boxes[key]
+        keys[key] = ('bbox', box) if box is not None and shared[box] == 1 else path_geometry_key(elem, tolerance)
+    return [keys[key] for key in raw]
+
+
+def dedupe_layers(layers, tolerance=DEDUPE_TOLERANCE, across_layers=DEDUPE_ACROSS_LAYERS):
+    """
+    Remove repeated geometry from {color: [path elements]} (in drawing
+    order), keeping the first copy within a layer and, across layers, the
+    copy in the layer drawn last.  Returns ({color: kept}, {color: removed}).
+    """
+    order = [(color, e) for color, elems in layers.items() for e in elems]
+    keyed = {color: [] for color in layers}
+    for (color, elem), key in zip(order, geometry_keys([e for _, e in order], tolerance)):
+        keyed[color].append((key, elem))
+    later = set()
+    result = {}
+    removed = {}
+    for color in reversed(list(keyed)):
+        seen = set()
+        kept = []
+        for key, elem in keyed[color]:
+            if key in seen or (across_layers and key in later):
+                continue
+            seen.add(key)
+            kept.append(elem)
+        later |= seen
+        result[color] = kept
+        if len(kept) < len(keyed[color]):
+            removed[color] = len(keyed[color]) - len(kept)
+    return {color: result[color] for color in layers}, removed
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# Stream converted G-code layers to a GRBL-style controller over a serial port
+
+import os
+import re
+import sys
+import glob
+import gzip
+import time
+import tty
+import select
+import termios
+import logging
+import argparse
+from collections import deque
+from palette import PEN_NAMES
+
+DEFAULT_BAUD = 115200
+# GRBL's serial receive buffer: never have more unacknowledged bytes in flight
+RX_BUFFER_SIZE = 128
+# Seconds without any controller response before the stream is abandoned;
+# long enough for the slowest single move plus a pen-change sync
+RESPONSE_TIMEOUT = 60
+# Time the controller needs to boot after the port opens (many boards reset on connect)
+DEFAULT_SETTLE = 2.0
+
+logger = logging.getLogger('gcode_streamer')
+
+
+class StreamError(Exception):
+    pass
+
+
+class TTYPort:
+    """Raw serial port on a tty device (a USB serial adapter or a pseudo-terminal)."""
+
+    def __init__(self, path, baud=DEFAULT_BAUD):
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        speed = getattr(termios, f'B{baud}', None)
+        if speed is not None:
+            attrs = termios.tcgetattr(self.fd)
+            attrs[4] = attrs[5] = speed
+            termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self._pending = bytearray()
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def readline(self, timeout):
+        """Next line from the controller, or b'' if none arrived within timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                return b''
+            chunk = os.read(self.fd, 4096)
+            if not chunk:
+                raise StreamError("Serial port closed")
+            self._pending += chunk
+        line, _, rest = bytes(self._pending).partition(b'\n')
+        self._pending = bytearray(rest)
+        return line + b'\n'
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+        self._pending.clear()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def clean_line(line):
+    """A G-code line as sent to the controller: comments and whitespace stripped ('' if nothing is left)."""
+    line = re.sub(r'\([^)]*\)', '', line.split(';', 1)[0])
+    return ''.join(line.split()).upper()
+
+
+def order_layers(paths):
+    """(colour, path) pairs for layer files, in pen drawing order (palette.PEN_NAMES), unknown colours last."""
+    layers = []
+    for path in paths:
+        color = os.path.basename(path).split('.', 1)[0]
+        layers.append((color, path))
+    rank = {name: i for i, name in enumerate(PEN_NAMES)}
+    return sorted(layers, key=lambda layer: (rank.get(layer[0], len(rank)), layer[0]))
+
+
+def _open_gcode(path):
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+
+class GcodeStreamer:
+    """
+    Character-counting streamer (the "aggressive" protocol GRBL documents):
+    lines are sent as long as the bytes not yet acknowledged fit in the
+    controller's RX buffer, so the planner always has the next moves
+    queued instead of idling for a round trip after every line.
+    send_and_wait=True keeps one line in flight, for comparison.
+    """
+
+    def __init__(self, port, rx_buffer=RX_BUFFER_SIZE, send_and_wait=False, timeout=RESPONSE_TIMEOUT):
+        self.port = port
+        self.rx_buffer = rx_buffer
+        self.send_and_wait = send_and_wait
+        self.timeout = timeout
+        self.in_flight = deque()
+        self.buffered = 0
+        self.stats = {'lines': 0, 'bytes': 0, 'errors': [], 'wait_seconds': 0.0, 'paused_seconds': 0.0,
+                      'occupancy_sum': 0, 'max_buffered': 0}
+        self.started = None
+
+    def wake(self, settle=DEFAULT_SETTLE):
+        """Wake the controller and discard its start-up banner."""
+        self.port.write(b'\r\n\r\n')
+        time.sleep(settle)
+        self.port.reset_input_buffer()
+
+    def _await_response(self):
+        waited = time.monotonic()
+        while True:
+            raw = self.port.readline(self.timeout)
+            if not raw:
+                raise StreamError(f"No response from controller for {self.timeout}s "
+                                  f"({len(self.in_flight)} lines unacknowledged)")
+            text = raw.decode(errors='replace').strip()
+            if text == 'ok' or text.startswith('error'):
+                length, line = self.in_flight.popleft()
+                self.buffered -= length
+                if text != 'ok':
+                    logger.warning("%s for line %d: %s", text, self.stats['lines'] - len(self.in_flight), line)
+                    self.stats['errors'].append((line, text))
+                break
+            if text.startswith('ALARM'):
+                raise StreamError(f"Controller alarm: {text}")
+            if text:
+                logger.debug("controller: %s", text)
+        self.stats['wait_seconds'] += time.monotonic() - waited
+
+    def send(self, line):
+        data = (line + '\n').encode()
+        if len(data) > self.rx_buffer:
+            raise StreamError(f"Line longer than the controller buffer ({len(data)} bytes): {line}")
+        while self.in_flight and (self.send_and_wait or self.buffered + len(data) > self.rx_buffer):
+            self._await_response()
+        if self.started is None:
+            self.started = time.monotonic()
+        self.port.write(data)
+        self.in_flight.append((len(data), line))
+        self.buffered += len(data)
+        self.stats['lines'] += 1
+        self.stats['bytes'] += len(data)
+        self.stats['occupancy_sum'] += self.buffered
+        self.stats['max_buffered'] = max(self.stats['max_buffered'], self.buffered)
+
+    def drain(self):
+        while self.in_flight:
+            self._await_response()
+
+    def sync(self):
+        """Return once the machine has finished every queued move (GRBL acknowledges G4 P0 only then)."""
+        self.send('G4P0')
+        self.drain()
+
+    def stream_lines(self, lines):
+        for line in lines:
+            line = clean_line(line)
+            if line:
+                self.send(line)
+
+    def stream_job(self, layers, pen_change=None):
+        """
+        Stream [(colour, path)] layers in order.  Before every layer after
+        the first the pen is lifted, the machine finishes its moves and
+        pen_change(colour) is called (e.g. to wait for the operator).
+        """
+        for i, (color, path) in enumerate(layers):
+            if i and pen_change:
+                self.send('M5')
+                self.sync()
+                paused = time.monotonic()
+                pen_change(color)
+                self.stats['paused_seconds'] += time.monotonic() - paused
+            logger.info("Streaming %s layer: %s", color, path)
+            with _open_gcode(path) as f:
+                self.stream_lines(f)
+        self.sync()
+        return self.report()
+
+    def report(self):
+        # operator time at pen changes is not streaming time
+        seconds = time.monotonic() - self.started - self.stats['paused_seconds'] if self.started else 0.0
+        lines = self.stats['lines']
+        return {
+            'lines': lines,
+            'bytes': self.stats['bytes'],
+            'seconds': round(seconds, 3),
+            'lines_per_second': round(lines / seconds, 1) if seconds else 0.0,
+            'mean_buffered': round(self.stats['occupancy_sum'] / lines, 1) if lines else 0.0,
+            'max_buffered': self.stats['max_buffered'],
+            'wait_seconds': round(self.stats['wait_seconds'], 3),
+            'errors': len(self.stats['errors']),
+        }
+
+
+def _prompt_pen_change(color):
+    input(f"Load the {color} pen, then press Enter to continue... ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream G-code layers to a GRBL-style controller')
+    parser.add_argument('port', help='Serial device, e.g. /dev/ttyUSB0 (or a simulator pty)')
+    parser.add_argument('paths', nargs='+',
+                        help='Layer .gcode files, or a result folder whose layers are sent in pen order')
+    parser.add_argument('--baud', type=int, default=DEFAULT_BAUD, help='Serial speed')
+    parser.add_argument('--rx-buffer', type=int, default=RX_BUFFER_SIZE,
+                        help='Controller receive buffer in bytes')
+    parser.add_argument('--send-and-wait', action='store_true',
+                        help='Wait for each ok before sending the next line')
+    parser.add_argument('--no-pause', action='store_true', help='Do not stop for pen changes between layers')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE,
+                        help='Seconds to wait for the controller to boot after connecting')
+    parser.add_argument('--verbose', action='store_true', help='Log controller messages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(levelname)s %(message)s')
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.gcode'))))
+        else:
+            files.append(path)
+    if not files:
+        print("Error: no G-code files given")
+        return 1
+    # Explicit files keep their order; folders are sent in pen order
+    layers = order_layers(files) if any(os.path.isdir(p) for p in args.paths) else \
+        [(os.path.basename(p).split('.', 1)[0], p) for p in files]
+
+    port = TTYPort(args.port, args.baud)
+    streamer = GcodeStreamer(port, args.rx_buffer, args.send_and_wait)
+    try:
+        streamer.wake(args.settle)
+        report = streamer.stream_job(layers, None if args.no_pause else _prompt_pen_change)
+    except (StreamError, KeyboardInterrupt) as e:
+        # Feed hold, then soft reset, so the machine stops where it is
+        port.write(b'!')
+        time.sleep(0.2)
+        port.write(b'\x18')
+        print(f"Stopped: {e or 'interrupted'}")
+        return 1
+    finally:
+        port.close()
+    print(f"{report['lines']} lines in {report['seconds']}s ({report['lines_per_second']} lines/s), "
+          f"mean {report['mean_buffered']} of {args.rx_buffer} buffer bytes in use, {report['errors']} errors")
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
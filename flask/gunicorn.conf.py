@@ -0,0 +1,71 @@
+# gunicorn configuration for the production image (see Dockerfile.prod)
+import os
+from admission import WEB_CONCURRENCY, ADMISSION_CAPACITY, MAX_CONVERSIONS
+
+SVG_PROCESSING_TIMEOUT = int(os.environ.get('SVG_PROCESSING_TIMEOUT', 30))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+
+# Import the app once in the master; workers share it copy-on-write (conversions
+# run in a per-worker forkserver with its own copy of the libraries, see wsgi.py)
+preload_app = True
+
+# One process per core; each worker serves a bounded number of requests concurrently.
+# Threads mostly wait on conversion processes; how many conversions actually run
+# is bounded by admission control (slots + queue of the fast, heavy and batch lanes), so
+# keep threads at least that large or the excess queues invisibly in gunicorn.
+workers = WEB_CONCURRENCY
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', ADMISSION_CAPACITY + 2))
+
+# Each of the MAX_CONVERSIONS conversions a worker may run at once is allowed
+# this much (tile workers are inside that budget; a batch runs BATCH_WORKERS of them)
+SVG_PROCESSING_MAX_RSS_MB = int(os.environ.get('SVG_PROCESSING_MAX_RSS_MB', 400))
+# Master, workers and their forkservers, before any conversion runs
+BASE_MEMORY_MB = int(os.environ.get('BASE_MEMORY_MB', 160))
+
+
+def _memory_limit_mb():
+    """The container's memory limit (cgroup v2 or v1) in MB, or None when unlimited."""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+        return None
+    return None
+
+
+def on_starting(server):
+    # With more worst-case memory than the container has, the kernel OOM
+    # killer fires before any conversion budget does
+    limit = _memory_limit_mb()
+    worst = BASE_MEMORY_MB + workers * MAX_CONVERSIONS * SVG_PROCESSING_MAX_RSS_MB
+    if limit and worst > limit:
+        server.log.warning(f"{workers} workers x {MAX_CONVERSIONS} conversions x {SVG_PROCESSING_MAX_RSS_MB} MB "
+                           f"(+{BASE_MEMORY_MB} MB) can exceed the {limit} MB memory limit; lower WEB_CONCURRENCY, "
+                           f"the lane slots, BATCH_WORKERS or SVG_PROCESSING_MAX_RSS_MB")
+
+# Queue depth of not-yet-accepted connections before the kernel refuses them
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 64))
+
+# Recycle workers periodically to contain memory growth; jitter avoids
+# every worker restarting at the same moment
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 200))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 50))
+
+# A worker must outlive the longest allowed conversion plus upload/zip time;
+# on shutdown/recycle, in-flight conversions get the full budget to finish
+timeout = SVG_PROCESSING_TIMEOUT + 30
+graceful_timeout = SVG_PROCESSING_TIMEOUT + 5
+keepalive = 5
+
+# Heartbeat files on tmpfs so a slow disk cannot make healthy workers look hung
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
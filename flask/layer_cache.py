@@ -0,0 +1,148 @@
+import os
+import json
+import shutil
+import hashlib
+from importlib import metadata
+from artifacts import store as artifact_store
+
+# Compiled per-layer G-code keyed by layer geometry and emission parameters,
+# so a revised upload only recompiles the colours that actually changed.
+# Empty disables the cache.  The default is next to the app (not relative to
+# the working directory), or on the shared filesystem with a shared
+# artifact store, so nodes reuse each other's layers.
+LAYER_CACHE_DIR = os.environ.get('LAYER_CACHE_DIR', artifact_store.cache_dir(
+    'layer_cache', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'layer_cache')))
+LAYER_CACHE_MAX_MB = int(os.environ.get('LAYER_CACHE_MAX_MB', 512))
+# Bump when CustomGcode or the compiler settings change what a layer emits
+# (2: entries carry a metadata file)
+GCODE_FORMAT_VERSION = 2
+
+try:
+    _COMPILER_VERSION = metadata.version('svg-to-gcode')
+except metadata.PackageNotFoundError:
+    _COMPILER_VERSION = 'unknown'
+
+
+def enabled():
+    return bool(LAYER_CACHE_DIR)
+
+
+def layer_fingerprint(layer):
+    """
+    sha256 of a layer's geometry: the root attributes that place it on the
+    canvas plus every bucketed element, attributes sorted so the result does
+    not depend on attribute order in the source file.
+    """
+    digest = hashlib.sha256()
+    for elem in layer.iter():
+        digest.update(elem.tag.encode())
+        for name, value in sorted(elem.attrib.items()):
+            digest.update(b'\0' + name.encode() + b'=' + value.encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def layer_key(fingerprint, color, speed, *params):
+    """Cache key: geometry plus everything that shapes the emitted G-code (extra `params` such as clip bounds)."""
+    params = '|'.join(str(p) for p in (fingerprint, color, speed, GCODE_FORMAT_VERSION, _COMPILER_VERSION) + params)
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(LAYER_CACHE_DIR, key[:2], f'{key}.gcode')
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def fetch(key, out_file, meta=None):
+    """
+    Materialise a cached layer at out_file; False on a miss.  `meta`, if
+    given, is updated with what was stored alongside the layer (such as its
+    clipping counts), so a hit reports the same as a fresh compile.
+    """
+    if not enabled():
+        return False
+    path = _entry_path(key)
+    try:
+        with open(_meta_path(path)) as f:
+            stored_meta = json.load(f)
+        if os.path.exists(out_file):
+            os.remove(out_file)
+        try:
+            # Layers are never modified after being written, so sharing the inode is safe
+            os.link(path, out_file)
+        except OSError:
+            shutil.copyfile(path, out_file)
+        # Recently used entries survive pruning
+        os.utime(path)
+    except (FileNotFoundError, ValueError):
+        return False
+    if meta is not None:
+        meta.update(stored_meta)
+    return True
+
+
+def store(key, gcode_file, meta=None):
+    """
+    Add a freshly compiled layer, and the JSON-serialisable `meta` that
+    fetch replays, to the cache (atomic; failures only cost a future
+    recompile).  The metadata is written first, so a visible layer always
+    has it.
+    """
+    if not enabled():
+        return
+    path = _entry_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta or {}, f)
+        os.replace(tmp_path, _meta_path(path))
+        shutil.copyfile(gcode_file, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def prune(max_mb=LAYER_CACHE_MAX_MB):
+    """Drop least recently used entries until the cache is under max_mb; returns (entries, bytes) removed."""
+    if not enabled() or not os.path.isdir(LAYER_CACHE_DIR):
+        return 0, 0
+    entries = []
+    for shard in os.scandir(LAYER_CACHE_DIR):
+        if not shard.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(shard.path):
+            # a layer and its metadata are aged and removed together (by the layer's last use)
+            if not entry.name.endswith('.gcode'):
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            size = st.st_size
+            try:
+                size += os.path.getsize(_meta_path(entry.path))
+            except OSError:
+                pass
+            entries.append((st.st_mtime, size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    limit = max_mb * 1024 * 1024
+    removed = removed_bytes = 0
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        try:
+            os.remove(_meta_path(path))
+        except OSError:
+            pass
+        total -= size
+        removed += 1
+        removed_bytes += size
+    return removed, removed_bytes
@@ -0,0 +1,125 @@
+import os
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Machine model for run-time estimates: acceleration in mm/s², GRBL-style
+# junction deviation in mm, and the time the pen servo needs per up/down
+MACHINE_ACCEL = float(os.environ.get('MACHINE_ACCEL', 500))
+JUNCTION_DEVIATION = float(os.environ.get('JUNCTION_DEVIATION', 0.01))
+PEN_DELAY_SECONDS = float(os.environ.get('PEN_DELAY_SECONDS', 0.15))
+
+# One match per linear move (feed, x, y) or pen command (3/5), in file
+# order; spaces between words are optional.  svg_to_gcode always writes
+# both X and Y on a move.
+_COMMAND_RE = re.compile(r'^G0?[01] ?(?:F([-\d.]+) ?)?X([-\d.]+) ?Y([-\d.]+)|^M0?([35])(?![\d.])', re.M)
+
+
+def _column(values):
+    """Regex group strings as floats, NaN where the group did not match."""
+    return np.array([v or 'nan' for v in values], dtype=float)
+
+
+def _forward_fill(values, valid):
+    """values with every invalid entry replaced by the last valid one before it (index 0 when there is none)."""
+    idx = np.where(valid, np.arange(len(values)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+def _segment_seconds(length, v_max, v_in, v_out, accel):
+    """Trapezoidal (or triangular, when too short to reach v_max) move times."""
+    d_acc = (v_max ** 2 - v_in ** 2) / (2 * accel)
+    d_dec = (v_max ** 2 - v_out ** 2) / (2 * accel)
+    cruise = length - d_acc - d_dec
+    trapezoid = (v_max - v_in) / accel + (v_max - v_out) / accel + np.maximum(cruise, 0) / v_max
+    peak = np.sqrt(np.maximum((2 * accel * length + v_in ** 2 + v_out ** 2) / 2, np.maximum(v_in, v_out) ** 2))
+    triangle = (2 * peak - v_in - v_out) / accel
+    return np.where(cruise >= 0, trapezoid, triangle)
+
+
+def estimate_moves(x, y, pen_down, feed, stop_before, accel=MACHINE_ACCEL, junction=JUNCTION_DEVIATION):
+    """
+    Distances and motion time for a sequence of moves from the origin.
+    `feed` is in mm/min; stop_before[i] marks moves the machine starts
+    from rest (after a pen command, which empties GRBL's planner).
+    Between other moves the junction speed follows GRBL: limited by the
+    angle between them and by both feeds.
+    """
+    dx = np.diff(x, prepend=0.0)
+    dy = np.diff(y, prepend=0.0)
+    length = np.hypot(dx, dy)
+    keep = length > 1e-9
+    # zero-length moves are dropped, but a stop before one carries over to the next real move
+    group = np.cumsum(keep) - keep
+    counted = group < keep.sum()
+    stop_before = np.bincount(group[counted], weights=stop_before[counted], minlength=int(keep.sum())) > 0
+    dx, dy, length, pen_down, v_max = dx[keep], dy[keep], length[keep], pen_down[keep], feed[keep] / 60.0
+    draw = float(length[pen_down].sum())
+    travel = float(length[~pen_down].sum())
+    if not len(length):
+        return draw, travel, 0.0
+
+    ux, uy = dx / length, dy / length
+    cos_theta = -(ux[:-1] * ux[1:] + uy[:-1] * uy[1:])
+    sin_half = np.sqrt(np.clip(0.5 * (1 - cos_theta), 0, 1))
+    with np.errstate(divide='ignore'):
+        v_corner = np.sqrt(accel * junction * sin_half / np.maximum(1 - sin_half, 1e-12))
+    v_junction = np.minimum(v_corner, np.minimum(v_max[:-1], v_max[1:]))
+    v_junction = np.where(stop_before[1:], 0.0, v_junction)
+    v_in = np.r_[0.0, v_junction]
+    v_out = np.r_[v_junction, 0.0]
+    seconds = float(_segment_seconds(length, v_max, v_in, v_out, accel).sum())
+    return draw, travel, seconds
+
+
+def estimate_gcode(path, speed, accel=MACHINE_ACCEL, junction=JUNCTION_DEVIATION, pen_delay=PEN_DELAY_SECONDS):
+    """
+    Draw and travel distance (mm), pen lifts and estimated run time of one
+    G-code layer.  Moves made with the pen down (after M3) are drawing;
+    F0 or a missing feed runs at `speed` (mm/min), as svg_to_gcode emits
+    drawing moves with F0.  Returns None without numpy.
+    """
+    if np is None:
+        return None
+    with open(path) as f:
+        rows = _COMMAND_RE.findall(f.read())
+    if not rows:
+        return {'draw_mm': 0.0, 'travel_mm': 0.0, 'pen_lifts': 0, 'seconds': 0.0}
+    feed, x, y, pen = (_column(col) for col in zip(*rows))
+    is_pen = ~np.isnan(pen)
+    # pen state each command leaves behind, index 0 being the initial "pen up"
+    state = _forward_fill(np.r_[False, pen == 3], np.r_[True, is_pen])[1:]
+    lifts = int(np.count_nonzero(is_pen & ~state & np.r_[False, state[:-1]]))
+    pen_commands = int(np.count_nonzero(is_pen))
+
+    moves = ~is_pen
+    has_feed = ~np.isnan(feed)
+    feed = _forward_fill(np.r_[0.0, feed], np.r_[True, has_feed])[1:]
+    feed = np.where(feed > 0, feed, speed)
+    # a move starts from rest when a pen command came right before it
+    pen_count = np.cumsum(is_pen)
+    stop_before = np.diff(np.r_[0, pen_count[moves]]) > 0
+
+    draw, travel, seconds = estimate_moves(x[moves], y[moves], state[moves], feed[moves], stop_before,
+                                           accel, junction)
+    return {
+        'draw_mm': round(draw, 1),
+        'travel_mm': round(travel, 1),
+        'pen_lifts': lifts,
+        'seconds': round(seconds + pen_commands * pen_delay, 1),
+    }
+
+
+def estimate_layers(gcode_files, speed):
+    """{'layers': {color: estimate}, 'total': summed estimate} for {color: gcode path}; None without numpy."""
+    if np is None:
+        return None
+    layers = {color: estimate_gcode(path, speed) for color, path in gcode_files.items()}
+    total = {key: round(sum(layer[key] for layer in layers.values()), 1)
+             for key in ('draw_mm', 'travel_mm', 'seconds')}
+    total['pen_lifts'] = sum(layer['pen_lifts'] for layer in layers.values())
+    return {'layers': layers, 'total': total}
@@ -0,0 +1,31 @@
+import threading
+
+# Process-local counters and gauges served by /api/metrics.  Under gunicorn
+# every worker keeps its own set; the response includes the pid.
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_collectors = []
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def register_collector(collector):
+    """Register a callable returning a dict of values computed at scrape time."""
+    _collectors.append(collector)
+
+
+def snapshot():
+    with _lock:
+        data = {'counters': dict(_counters), 'gauges': dict(_gauges)}
+    for collector in _collectors:
+        data['gauges'].update(collector())
+    return data
@@ -0,0 +1,209 @@
+import os
+import re
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Pens loaded in the plotter as name=#rrggbb pairs, in drawing order; the
+# names become the layer names.  Coloured document colours are drawn with
+# the coloured pen of the closest hue, greys with the grey/black pen of
+# the closest lightness (see _assign).
+PEN_PALETTE = os.environ.get('PEN_PALETTE', 'cyan=#00aeef,magenta=#ec008c,yellow=#fff200,black=#000000')
+# 'nearest' maps each colour to its closest pen; 'kmeans' clusters the
+# document's colours around the pens first, so a run of similar shades
+# (gradients) splits where the document's own colours divide; 'auto' uses
+# kmeans once a document has more colours than there are pens.
+PALETTE_MODE = os.environ.get('PALETTE_MODE', 'auto').lower()
+KMEANS_ITERATIONS = 10
+# Colours with less CIE chroma than this count as greys
+ACHROMATIC_CHROMA = float(os.environ.get('ACHROMATIC_CHROMA', 10))
+# Greys at least this light (CIE L*, e.g. white background rects) are the
+# paper's colour and are not drawn; above 100 draws them like other greys
+PAPER_LIGHTNESS = float(os.environ.get('PAPER_LIGHTNESS', 92))
+# Weight of CIEDE2000 against hue difference (degrees) when choosing between
+# coloured pens; it only decides between pens of similar hue
+DELTA_E_WEIGHT = 0.25
+
+_PEN_RE = re.compile(r'^([a-z0-9_-]+)\s*=\s*#?([0-9a-f]{6}|[0-9a-f]{3})$')
+
+# linear sRGB → XYZ (D65), and the D65 reference white
+_RGB_TO_XYZ = ((0.4124, 0.3576, 0.1805),
+               (0.2126, 0.7152, 0.0722),
+               (0.0193, 0.1192, 0.9505))
+_WHITE = (0.95047, 1.0, 1.08883)
+
+
+def load_palette(spec=PEN_PALETTE):
+    """[(name, (r, g, b)), ...] from a PEN_PALETTE string (#rrggbb or #rgb); raises ValueError on a malformed entry."""
+    pens = []
+    for entry in spec.lower().split(','):
+        if not entry.strip():
+            continue
+        m = _PEN_RE.match(entry.strip())
+        if not m:
+            raise ValueError(f"Bad PEN_PALETTE entry: {entry.strip()!r}")
+        h = m.group(2)
+        if len(h) == 3:
+            h = ''.join(c * 2 for c in h)
+        pens.append((m.group(1), tuple(int(h[i:i + 2], 16) for i in (0, 2, 4))))
+    if not pens:
+        raise ValueError("PEN_PALETTE is empty")
+    return pens
+
+
+PENS = load_palette()
+PEN_NAMES = [name for name, _ in PENS]
+# Layer for elements without a usable colour: black if loaded, else the darkest pen
+DEFAULT_PEN = 'black' if 'black' in PEN_NAMES else min(PENS, key=lambda pen: sum(pen[1]))[0]
+
+
+def rgb_to_lab(rgb):
+    """CIE L*a*b* for an (n, 3) array of 0-255 sRGB colours."""
+    c = np.asarray(rgb, dtype=float) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array(_RGB_TO_XYZ).T / np.array(_WHITE)
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def rgb_hue(rgb):
+    """Hue angle in degrees on the sRGB (HSV) hue circle for an (n, 3) array of 0-255 colours."""
+    c = np.asarray(rgb, dtype=float)
+    r, g, b = c[:, 0], c[:, 1], c[:, 2]
+    return np.degrees(np.arctan2(np.sqrt(3) * (g - b), 2 * r - g - b)) % 360
+
+
+def delta_e2000(lab1, lab2):
+    """CIEDE2000 colour difference between broadcastable arrays of Lab colours (last axis L, a, b)."""
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+    c_mean7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+    g = 0.5 * (1 - np.sqrt(c_mean7 / (c_mean7 + 25.0 ** 7)))
+    a1, a2 = a1 * (1 + g), a2 * (1 + g)
+    c1, c2 = np.hypot(a1, b1), np.hypot(a2, b2)
+    h1 = np.degrees(np.arctan2(b1, a1)) % 360
+    h2 = np.degrees(np.arctan2(b2, a2)) % 360
+    chromatic = c1 * c2 != 0
+
+    dh = h2 - h1
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh)) * chromatic
+    d_hue = 2 * np.sqrt(c1 * c2) * np.sin(np.radians(dh / 2))
+    h_mean = np.where(np.abs(h1 - h2) > 180, (h1 + h2 + 360) / 2, (h1 + h2) / 2) % 360
+    h_mean = np.where(chromatic, h_mean, h1 + h2)
+    l_mean = (L1 + L2) / 2
+    c_mean = (c1 + c2) / 2
+
+    t = (1 - 0.17 * np.cos(np.radians(h_mean - 30)) + 0.24 * np.cos(np.radians(2 * h_mean))
+         + 0.32 * np.cos(np.radians(3 * h_mean + 6)) - 0.20 * np.cos(np.radians(4 * h_mean - 63)))
+    s_l = 1 + 0.015 * (l_mean - 50) ** 2 / np.sqrt(20 + (l_mean - 50) ** 2)
+    s_c = 1 + 0.045 * c_mean
+    s_h = 1 + 0.015 * c_mean * t
+    r_t = (-2 * np.sqrt(c_mean ** 7 / (c_mean ** 7 + 25.0 ** 7))
+           * np.sin(np.radians(60 * np.exp(-((h_mean - 275) / 25) ** 2))))
+    dl, dc, dhh = (L2 - L1) / s_l, (c2 - c1) / s_c, d_hue / s_h
+    return np.sqrt(dl ** 2 + dc ** 2 + dhh ** 2 + r_t * dc * dhh)
+
+
+def _hue_distance(hues, pen_hues):
+    """Circular difference in degrees between every hue and every pen hue."""
+    d = np.abs(hues[:, None] - pen_hues[None, :]) % 360
+    return np.minimum(d, 360 - d)
+
+
+def _hue_circle(hues):
+    """Hues as points on the unit circle, where Euclidean distance grows with the hue difference."""
+    return np.stack([np.cos(np.radians(hues)), np.sin(np.radians(hues))], axis=1)
+
+
+def _nearest(points, centers):
+    """Index of the closest centre for every point (squared Euclidean distance)."""
+    return ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+
+
+def _kmeans(points, weights, seeds, labels):
+    """
+    Weighted k-means starting from the pen colours (and the pens' initial
+    `labels`), so cluster i stays pen i's.  Each pen colour also counts
+    as an anchor point in its own cluster, so a centre cannot drift far
+    from the ink it stands for.
+    """
+    anchor = weights.sum() / len(seeds)
+    centers = seeds.copy()
+    for _ in range(KMEANS_ITERATIONS):
+        totals = seeds * anchor
+        np.add.at(totals, labels, points * weights[:, None])
+        mass = np.bincount(labels, weights=weights, minlength=len(centers)) + anchor
+        centers = totals / mass[:, None]
+        new_labels = _nearest(points, centers)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels
+
+
+def _assign_chromatic(rgb, lab, weights, pen_rgb, pen_lab, cluster):
+    """
+    Pen index for coloured colours: the pen of the closest hue on the sRGB
+    hue circle, CIEDE2000 deciding between pens of similar hue.  (Lab hue
+    alone puts sRGB blue nearer magenta than cyan.)  With `cluster`,
+    hues are first grouped around the pens by k-means on the hue circle.
+    """
+    hues, pen_hues = rgb_hue(rgb), rgb_hue(pen_rgb)
+    cost = _hue_distance(hues, pen_hues) + DELTA_E_WEIGHT * delta_e2000(lab[:, None], pen_lab[None, :])
+    labels = cost.argmin(axis=1)
+    if cluster:
+        labels = _kmeans(_hue_circle(hues), weights, _hue_circle(pen_hues), labels)
+    return labels
+
+
+@lru_cache(maxsize=64)
+def _assign(histogram, pens, mode):
+    """
+    Greys (chroma below ACHROMATIC_CHROMA) go to the grey/black pen of the
+    closest lightness, or nowhere (None) when light enough to be the paper;
+    coloured colours go to the coloured pens by hue.  When the palette
+    lacks one of the two kinds of pen, CIEDE2000 picks among all pens.
+    """
+    colors = [rgb for rgb, _ in histogram]
+    if np is None:
+        # Without numpy: closest pen in plain RGB, one colour at a time
+        return tuple(
+            (rgb, min(pens, key=lambda pen: sum((a - b) ** 2 for a, b in zip(rgb, pen[1])))[0])
+            for rgb in colors)
+    rgb = np.array(colors, dtype=float)
+    lab = rgb_to_lab(rgb)
+    pen_rgb = np.array([p for _, p in pens], dtype=float)
+    pen_lab = rgb_to_lab(pen_rgb)
+    grey = np.hypot(lab[:, 1], lab[:, 2]) < ACHROMATIC_CHROMA
+    grey_pens = np.hypot(pen_lab[:, 1], pen_lab[:, 2]) < ACHROMATIC_CHROMA
+    weights = np.array([count for _, count in histogram], dtype=float)
+
+    labels = delta_e2000(lab[:, None], pen_lab[None, :]).argmin(axis=1)
+    if grey_pens.any():
+        idx = np.flatnonzero(grey_pens)
+        labels[grey] = idx[np.abs(lab[grey, None, 0] - pen_lab[None, idx, 0]).argmin(axis=1)]
+    colored = ~grey
+    if colored.any() and (~grey_pens).any():
+        idx = np.flatnonzero(~grey_pens)
+        cluster = mode == 'kmeans' or (mode == 'auto' and colored.sum() > len(idx))
+        labels[colored] = idx[_assign_chromatic(rgb[colored], lab[colored], weights[colored],
+                                                pen_rgb[idx], pen_lab[idx], cluster)]
+    paper = grey & (lab[:, 0] >= PAPER_LIGHTNESS)
+    return tuple((c, None if skip else pens[i][0]) for c, i, skip in zip(colors, labels.tolist(), paper.tolist()))
+
+
+def assign_colors(counts, pens=None, mode=None):
+    """
+    Map every distinct document colour to a pen name (None for the paper
+    colour, which is not drawn) in one pass.
+    `counts` is {(r, g, b): number of elements using it}; the counts weight
+    the clustering.  Memoised on the document's colour histogram, so
+    re-converting a document (or a batch duplicate) skips the work.
+    """
+    if not counts:
+        return {}
+    pens = tuple(pens or PENS)
+    return dict(_assign(tuple(sorted(counts.items())), pens, mode or PALETTE_MODE))
@@ -0,0 +1,87 @@
+import io
+import os
+import re
+from xml.etree import ElementTree as ET
+
+PATH_TOKEN = re.compile(r'([A-Za-z])|(-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+CURVE_COMMANDS = set('CcSsQqTtAa')
+COLOR_DECL = re.compile(r'(?:stroke|fill)\s*:\s*([^;]+)')
+
+# Approximate compile cost in milliseconds, measured on the benchmark set:
+# curve parameters are adaptively linearised and dominate, straight
+# segments are cheap, shapes become fixed-size polygons.
+LINE_PARAM_MS = 0.035
+CURVE_PARAM_MS = 1.0
+SHAPE_MS = {'rect': 0.3, 'line': 0.1, 'polyline': 0.5, 'polygon': 0.5, 'circle': 2.5, 'ellipse': 2.5}
+
+# Jobs estimated to take longer than this go to the heavy lane
+HEAVY_LANE_MIN_SECONDS = float(os.environ.get('HEAVY_LANE_MIN_SECONDS', 5))
+
+
+def _local(tag):
+    return tag.split('}')[-1]
+
+
+def scan_svg(data):
+    """
+    Single streaming pass over an SVG upload that counts elements, path
+    commands, distinct colours and nesting depth.  Elements are cleared as
+    soon as they close, so the full tree is never held in memory.
+    Raises ET.ParseError for malformed documents.
+    """
+    elements = 0
+    shapes = 0
+    texts = 0
+    path_commands = 0
+    line_params = 0
+    curve_params = 0
+    shape_ms = 0.0
+    depth = 0
+    max_depth = 0
+    colors = set()
+
+    for event, elem in ET.iterparse(io.BytesIO(data), events=('start', 'end')):
+        if event == 'end':
+            depth -= 1
+            elem.clear()
+            continue
+        depth += 1
+        max_depth = max(max_depth, depth)
+        elements += 1
+        tag = _local(elem.tag)
+        if tag == 'path':
+            command = 'M'
+            for letter, number in PATH_TOKEN.findall(elem.get('d', '')):
+                if letter:
+                    command = letter
+                    path_commands += 1
+                elif command in CURVE_COMMANDS:
+                    curve_params += 1
+                else:
+                    line_params += 1
+        elif tag in SHAPE_MS:
+            shapes += 1
+            shape_ms += SHAPE_MS[tag]
+        elif tag == 'text':
+            texts += 1
+        for attr in ('stroke', 'fill'):
+            value = elem.get(attr)
+            if value and value.lower() != 'none':
+                colors.add(value.strip().lower())
+        style = elem.get('style')
+        if style:
+            colors.update(m.strip().lower() for m in COLOR_DECL.findall(style) if m.strip().lower() != 'none')
+
+    estimated_seconds = (line_params * LINE_PARAM_MS + curve_params * CURVE_PARAM_MS + shape_ms) / 1000
+    return {
+        'bytes': len(data),
+        'elements': elements,
+        'shapes': shapes,
+        'texts': texts,
+        'path_commands': path_commands,
+        'path_params': line_params + curve_params,
+        'distinct_colors': len(colors),
+        'max_depth': max_depth,
+        'estimated_seconds': round(estimated_seconds, 2),
+        'lane': 'heavy' if estimated_seconds >= HEAVY_LANE_MIN_SECONDS else 'fast',
+    }
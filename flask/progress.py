@@ -0,0 +1,96 @@
+import time
+
+# Share of the total percentage each stage accounts for.  Layers are split
+# further by how many paths each one compiles.
+STAGE_WEIGHTS = {
+    'upload': 5,
+    'queue': 0,
+    'preview': 10,
+    'parse': 5,
+    'layers': 70,
+    'zip': 10,
+}
+# Seconds between keep-alive comments on an otherwise idle stream
+HEARTBEAT_SECONDS = 15
+
+_sink = None
+
+
+def set_progress_sink(sink):
+    """Install the callable report_progress forwards to (the conversion worker's pipe)."""
+    global _sink
+    _sink = sink
+
+
+def report_progress(stage, status, **info):
+    """Report a stage event from conversion code; a no-op unless a sink is installed."""
+    if _sink is not None:
+        _sink({'stage': stage, 'status': status, **info})
+
+
+class ConversionProgress:
+    """
+    Turns raw stage events into client events with percent complete and
+    per-stage timings, and passes each to `emit`.  Stages are 'start'ed and
+    'done'; the layers stage starts with {color: paths} weights and reports
+    each finished layer.
+    """
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.started = time.monotonic()
+        self.timings = {}
+        self._stage_started = {}
+        self._completed = 0.0
+        self._layer_weights = {}
+        self._layers_total = 0
+
+    def percent(self):
+        return min(100, int(self._completed * 100 / sum(STAGE_WEIGHTS.values())))
+
+    def _send(self, stage, status, **info):
+        self.emit({
+            'stage': stage,
+            'status': status,
+            'percent': self.percent(),
+            'elapsed': round(time.monotonic() - self.started, 3),
+            **info,
+        })
+
+    def start(self, stage, **info):
+        self._stage_started[stage] = time.monotonic()
+        self._send(stage, 'start', **info)
+
+    def done(self, stage, **info):
+        begun = self._stage_started.pop(stage, None)
+        seconds = round(time.monotonic() - begun, 3) if begun is not None else 0.0
+        self.timings[stage] = seconds
+        if stage == 'layers':
+            # Whatever the finished layers did not account for
+            self._completed += sum(self._layer_weights.values())
+            self._layer_weights = {}
+        else:
+            self._completed += STAGE_WEIGHTS.get(stage, 0)
+        self._send(stage, 'done', seconds=seconds, **info)
+
+    def update(self, event):
+        """Apply a raw event from report_progress (relayed from the worker process)."""
+        event = dict(event)
+        stage = event.pop('stage')
+        status = event.pop('status')
+        if stage == 'layers' and status == 'start':
+            weights = event.pop('weights', {}) or {}
+            total = sum(weights.values()) or 1
+            self._layer_weights = {color: STAGE_WEIGHTS['layers'] * n / total for color, n in weights.items()}
+            self._layers_total = len(weights)
+            self.start('layers', colors=list(weights), **event)
+        elif stage == 'layer':
+            color = event.get('color')
+            self._completed += self._layer_weights.pop(color, 0)
+            layer_timings = self.timings.setdefault('layer_seconds', {})
+            layer_timings[color] = event.get('seconds')
+            self._send('layer', status, total=self._layers_total, **event)
+        elif status == 'start':
+            self.start(stage, **event)
+        else:
+            self.done(stage, **event)
@@ -0,0 +1,84 @@
+import os
+import sys
+import hmac
+import cProfile
+import threading
+from collections import Counter
+from flask import request
+
+# Profile every conversion (debugging only) ...
+PROFILE_ALL_REQUESTS = os.environ.get('PROFILE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+# ... or only those carrying `X-Profile-Token: <PROFILE_ADMIN_TOKEN>`
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN')
+PROFILE_HEADER = 'X-Profile-Token'
+SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+
+PROFILE_DUMP = 'profile.prof'
+PROFILE_COLLAPSED = 'profile.collapsed'
+
+
+def profiling_requested():
+    """True when the current request opted in to profiling."""
+    if PROFILE_ALL_REQUESTS:
+        return True
+    if not PROFILE_ADMIN_TOKEN:
+        return False
+    token = request.headers.get(PROFILE_HEADER)
+    return bool(token) and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class RequestProfiler:
+    """
+    Deterministic cProfile run plus a stack sampler for the calling thread.
+    On exit writes profile.prof (pstats/snakeviz) and profile.collapsed
+    (flamegraph.pl / speedscope input) into the session folder, if it still exists.
+    """
+
+    def __init__(self, session_folder, app_logger=None):
+        self.session_folder = session_folder
+        self.app_logger = app_logger
+        self.profiler = cProfile.Profile()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._thread_id = None
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.disable()
+        self._stop.set()
+        self._sampler.join()
+        if not os.path.isdir(self.session_folder):
+            return False
+        try:
+            self.profiler.dump_stats(os.path.join(self.session_folder, PROFILE_DUMP))
+            with open(os.path.join(self.session_folder, PROFILE_COLLAPSED), 'w') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            if self.app_logger:
+                self.app_logger.info(f"Request profile written to {self.session_folder}")
+        except OSError as e:
+            if self.app_logger:
+                self.app_logger.warning(f"Could not write request profile: {e}")
+        return False
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import shutil
+import fcntl
+import threading
+import metrics
+import layer_cache
+from artifacts import store as artifact_store
+from conversion_budget import SVG_PROCESSING_TIMEOUT
+
+# Sessions not downloaded for this long are removed ...
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', 24 * 3600))
+# ... and beyond this total size the least recently downloaded go first
+SESSION_DISK_QUOTA_MB = int(os.environ.get('SESSION_DISK_QUOTA_MB', 2048))
+JANITOR_INTERVAL_SECONDS = int(os.environ.get('JANITOR_INTERVAL_SECONDS', 300))
+# Sessions written to this recently may still be converting; never evict them
+MIN_SESSION_AGE = SVG_PROCESSING_TIMEOUT + 60
+
+ACCESS_MARKER = '.last_access'
+LOCK_FILE = '.janitor.lock'
+STATS_FILE = '.janitor_stats.json'
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def touch_session(session_folder):
+    """Record a download so LRU eviction keeps sessions that are still in use."""
+    try:
+        with open(os.path.join(session_folder, ACCESS_MARKER), 'a'):
+            pass
+        os.utime(os.path.join(session_folder, ACCESS_MARKER))
+    except OSError:
+        pass
+
+
+def _session_info(entry):
+    """(last access, last write, size in bytes) of one session folder."""
+    last_write = entry.stat().st_mtime
+    last_access = last_write
+    size = 0
+    for f in os.scandir(entry.path):
+        st = f.stat(follow_symlinks=False)
+        if f.name == ACCESS_MARKER:
+            last_access = max(last_access, st.st_mtime)
+        elif f.is_file(follow_symlinks=False):
+            size += st.st_size
+    return last_access, last_write, size
+
+
+def _read_stats(upload_folder):
+    try:
+        with open(os.path.join(upload_folder, STATS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def sweep(upload_folder, ttl=SESSION_TTL_SECONDS, quota_mb=SESSION_DISK_QUOTA_MB, app_logger=None):
+    """
+    Remove sessions past their TTL, then evict least recently downloaded
+    sessions until the total is under quota.  Returns the stats written to
+    the shared stats file, or None if another process is already sweeping.
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+    with open(os.path.join(upload_folder, LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        now = time.time()
+        sessions = []
+        for entry in os.scandir(upload_folder):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                sessions.append((entry.path, *_session_info(entry)))
+            except OSError:
+                continue
+
+        evicted_ttl = 0
+        evicted_quota = 0
+        kept = []
+        for path, last_access, last_write, size in sessions:
+            if now - last_write < MIN_SESSION_AGE:
+                kept.append((path, last_access, size, False))
+            elif now - last_access > ttl:
+                shutil.rmtree(path, ignore_errors=True)
+                evicted_ttl += 1
+            else:
+                kept.append((path, last_access, size, True))
+
+        total = sum(size for _, _, size, _ in kept)
+        quota = quota_mb * 1024 * 1024
+        if total > quota:
+            for path, last_access, size, evictable in sorted(kept, key=lambda s: s[1]):
+                if total <= quota:
+                    break
+                if not evictable:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                evicted_quota += 1
+                kept = [k for k in kept if k[0] != path]
+
+        previous = _read_stats(upload_folder)
+        stats = {
+            'sessions_count': len(kept),
+            'sessions_disk_bytes': total,
+            'sessions_evicted_ttl_total': previous.get('sessions_evicted_ttl_total', 0) + evicted_ttl,
+            'sessions_evicted_quota_total': previous.get('sessions_evicted_quota_total', 0) + evicted_quota,
+            'janitor_last_sweep': now,
+        }
+        tmp_path = os.path.join(upload_folder, f'{STATS_FILE}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, os.path.join(upload_folder, STATS_FILE))
+
+    if app_logger and (evicted_ttl or evicted_quota):
+        app_logger.info(f"Janitor evicted {evicted_ttl} expired and {evicted_quota} over-quota sessions")
+    return stats
+
+
+def _run(upload_folder, app_logger):
+    while True:
+        try:
+            sweep(upload_folder, app_logger=app_logger)
+            layer_cache.prune()
+            artifact_store.collect_garbage()
+        except Exception as e:
+            if app_logger:
+                app_logger.error(f"Session janitor failed: {e}")
+        time.sleep(JANITOR_INTERVAL_SECONDS)
+
+
+def start_janitor(upload_folder, app_logger=None):
+    """Start the background sweeper once per process (workers forked after start get their own)."""
+    global _started_pid
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    metrics.register_collector(lambda: _read_stats(upload_folder))
+    thread = threading.Thread(target=_run, args=(upload_folder, app_logger), daemon=True)
+    thread.start()
@@ -1,10 +1,20 @@
 import os
 import re
 import math
+import time
+from collections import Counter
 import cairosvg
 from xml.etree import ElementTree as ET
-from svg_to_gcode.svg_parser import parse_file
+from svg_to_gcode.svg_parser import parse_root
+from svg_to_gcode.geometry import LineSegmentChain
 from svg_to_gcode.compiler import Compiler, interfaces
+import layer_cache
+import tiling
+from dedupe import dedupe_layers, DEDUPE_PATHS
+from clipping import clip_bounds, clip_curves, cull_layers
+from palette import assign_colors, PEN_NAMES, DEFAULT_PEN
+import text_outline
+from artifacts import store as artifact_store
 try:
     from matplotlib import colors as mcolors
 except ImportError:
@@ -16,8 +26,11 @@ CSS_COLOR_MAP = {
     # add more named colors here as needed
 }
 
-UPLOAD_FOLDER = 'static/uploads'
-CMYK_CHANNELS = ['cyan', 'magenta', 'yellow', 'black']
+# Default output folder for direct calls (static/uploads with the local store)
+UPLOAD_FOLDER = artifact_store.workspace_root()
+SVG_NS = 'http://www.w3.org/2000/svg'
+# Write layer SVGs with a default namespace instead of ns0: prefixes
+ET.register_namespace('', SVG_NS)
 
 
 class CustomGcode(interfaces.Gcode):
@@ -67,16 +80,22 @@ def normalize_color(color_str):
             return None
     return None
 
-def rgb_to_cmyk(r, g, b):
-    """Dominant-component heuristic."""
-    if r >= g and r >= b:
-        return 'magenta'
-    elif g >= r and g >= b:
-        return 'yellow'
-    elif b >= r and b >= g:
-        return 'cyan'
-    else:
-        return 'black'
+def map_colors(colors):
+    """
+    {colour string: pen layer} for a document's colour strings (repeats
+    allowed).  Distinct colours are assigned to pens together, weighted by
+    use; missing or unparseable colours go to the default pen, and the
+    paper colour (white) to None, meaning not drawn.
+    """
+    rgbs = {}
+    counts = Counter()
+    for col in colors:
+        if col not in rgbs:
+            rgbs[col] = normalize_color(col)
+        if rgbs[col]:
+            counts[rgbs[col]] += 1
+    pen_of = assign_colors(counts)
+    return {col: pen_of[rgb] if rgb else DEFAULT_PEN for col, rgb in rgbs.items()}
 
 def shape_to_path(elem):
     """
@@ -113,7 +132,7 @@ def shape_to_path(elem):
         for i in range(0, len(coords)-1, 2):
             try:
                 x = float(coords[i]); y = float(coords[i+1])
-            except:
+            except ValueError:
                 continue
             pairs.append((x,y))
         if pairs:
@@ -145,17 +164,54 @@ def shape_to_path(elem):
     if not d:
         return None
 
-    p = ET.Element('path', path_attr)
+    p = ET.Element(f'{{{SVG_NS}}}path', path_attr)
     p.set('d', d)
     return p
 
 
-def convert_svg_to_png(svg_path, output_folder=None, app_logger=None):
+def text_paths(root):
+    """<path> outlines for every <text> in the document (empty if TEXT_TO_PATHS is off or fontTools is missing)."""
+    if not text_outline.TEXT_TO_PATHS:
+        return []
+    paths = []
+    for el in root.findall('.//svg:text', namespaces={'svg': SVG_NS}):
+        paths.extend(text_outline.text_to_paths(el))
+    text_outline.flush()
+    return paths
+
+
+def load_svg_root(svg_source):
+    """
+    Root element of an SVG given as a file path, raw bytes/str, or an
+    already parsed element, so one upload is parsed once and shared.
+    """
+    if isinstance(svg_source, ET.Element):
+        return svg_source
+    if isinstance(svg_source, (bytes, bytearray, memoryview)):
+        return ET.fromstring(bytes(svg_source))
+    if isinstance(svg_source, str) and svg_source.lstrip().startswith('<'):
+        return ET.fromstring(svg_source)
+    return ET.parse(svg_source).getroot()
+
+
+def layer_root(root, elems):
+    """A new <svg> carrying the original root attributes and the given children."""
+    wrapper = ET.Element(f'{{{SVG_NS}}}svg', dict(root.attrib))
+    for e in elems:
+        wrapper.append(e)
+    return wrapper
+
+
+def convert_svg_to_png(svg_path, output_folder=None, app_logger=None, svg_data=None):
+    """Render a PNG preview; `svg_data` (the raw upload) avoids re-reading svg_path."""
     folder = output_folder or UPLOAD_FOLDER
     os.makedirs(folder, exist_ok=True)
     png_out = os.path.join(folder, 'original.png')
     try:
-        cairosvg.svg2png(url=svg_path, write_to=png_out)
+        if svg_data is not None:
+            cairosvg.svg2png(bytestring=bytes(svg_data), write_to=png_out)
+        else:
+            cairosvg.svg2png(url=svg_path, write_to=png_out)
     except Exception as e:
         if app_logger:
             app_logger.error(f"SVG→PNG failed: {e}, using placeholder")
@@ -168,16 +224,40 @@ def convert_svg_to_png(svg_path, output_folder=None, app_logger=None):
     return png_out
 
 
-def convert_svg_to_gcode(svg_path, color, speed, output_folder=None, app_logger=None):
+def new_compiler(color, speed):
+    return Compiler(lambda: CustomGcode(color),
+                    movement_speed=speed,
+                    cutting_speed=0,
+                    pass_depth=1)
+
+
+def compile_layer(root, color, speed, stats=None):
+    """
+    Compiler holding the G-code for everything drawn under `root`.  Geometry
+    outside the visible viewBox or the machine bed (see
+    clipping.clip_bounds) is dropped or cut before it reaches the compiler;
+    `stats` counts it.
+    """
+    curves = parse_root(root)
+    comp = new_compiler(color, speed)
+    bounds = clip_bounds(root)
+    if bounds is None:
+        comp.append_curves(curves)
+    else:
+        for item in clip_curves(curves, bounds, stats):
+            if isinstance(item, LineSegmentChain):
+                comp.append_line_chain(item)
+            else:
+                comp.append_curves([item])
+    return comp
+
+
+def convert_svg_to_gcode(svg_path, color, speed, output_folder=None, app_logger=None, stats=None):
+    """`svg_path` may also be an already parsed root element."""
     folder = output_folder or UPLOAD_FOLDER
     os.makedirs(folder, exist_ok=True)
     try:
-        curves = parse_file(svg_path)
-        comp = Compiler(lambda: CustomGcode(color),
-                        movement_speed=speed,
-                        cutting_speed=0,
-                        pass_depth=1)
-        comp.append_curves(curves)
+        comp = compile_layer(load_svg_root(svg_path), color, speed, stats)
         out_file = os.path.join(folder, f"{color}.gcode")
         comp.compile_to_file(out_file)
         return out_file
@@ -187,26 +267,39 @@ def convert_svg_to_gcode(svg_path, color, speed, output_folder=None, app_logger=
         return None
 
 
-def convert_svg_to_separated_gcode(svg_path, speed, output_folder=None, app_logger=None):
+def convert_svg_to_separated_gcode(svg_path, speed, output_folder=None, app_logger=None, on_layer=None,
+                                   on_progress=None, stats=None):
     """
     Returns (detected_colors, gcode_files_dict).  Shapes are first
-    converted to paths, so parse_file always finds curves.
-    Guarantees at least one 'black' G-code if nothing else maps.
+    converted to paths, so parse_root always finds curves.
+    Colours are mapped to the pens in palette.PEN_PALETTE (layers are
+    named after the pens).
+    Only a document with no path, shape or text at all is compiled whole
+    on the default (normally black) pen; one whose colours are all paper,
+    or whose geometry is all off-canvas, yields no layers.  Raises
+    ValueError when there were layers to draw but none of them compiled.
+    `svg_path` may be a path, the raw SVG bytes or a parsed root element.
+    on_layer(color, gcode_path) is called as soon as each layer is written.
+    on_progress(stage, status, **info) receives the layer plan and each
+    compiled layer (see progress.report_progress).
+    Layers whose geometry is unchanged since an earlier conversion are
+    reused from layer_cache; `stats`, if given, gets the reused and
+    compiled colours, the colours whose layer failed to compile
+    ('failed') and the duplicate paths removed per layer.
     """
     folder = output_folder or UPLOAD_FOLDER
     os.makedirs(folder, exist_ok=True)
 
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
+    root = load_svg_root(svg_path)
     svg_ns = {'svg': 'http://www.w3.org/2000/svg'}
 
     # prepare buckets
-    layers = {c: [] for c in CMYK_CHANNELS}
+    layers = {c: [] for c in PEN_NAMES}
     detected = []
-    seen = set()
+    entries = []
 
     def bucket(elem):
-        """Take a <path> element, decide its CMYK layer, clone & store."""
+        """Take a <path> element, find its colour, clone & queue it for pen assignment."""
         # prioritize stroke over fill
         col = elem.get('stroke')
         if not col or col.lower() == 'none':
@@ -218,17 +311,10 @@ def convert_svg_to_separated_gcode(svg_path, speed, output_folder=None, app_logg
             if m:
                 col = m.group(1).strip()
 
-        rgb   = normalize_color(col)
-        layer = rgb_to_cmyk(*rgb) if rgb else 'black'
-
-        if col and col not in seen:
-            seen.add(col)
-            detected.append({'original': col, 'mapped_to': layer})
-
         copy_attribs = dict(elem.attrib)
-        p = ET.Element('path', copy_attribs)
+        p = ET.Element(f'{{{SVG_NS}}}path', copy_attribs)
         p.set('d', elem.get('d',''))
-        layers[layer].append(p)
+        entries.append((p, col))
 
     # 1) bucket all real <path>
     for p in root.findall('.//svg:path', namespaces=svg_ns):
@@ -239,51 +325,132 @@ def convert_svg_to_separated_gcode(svg_path, speed, output_folder=None, app_logg
     for tag in ['rect','circle','ellipse','line','polyline','polygon']:
         for el in root.findall(f'.//svg:{tag}', namespaces=svg_ns):
             p = shape_to_path(el)
-            if p:
+            if p is not None:
                 bucket(p)
-
-    # 3) compile each non-empty layer
+    # ... and <text> outlined with locally installed fonts
+    for p in text_paths(root):
+        bucket(p)
+
+    # 3) assign all distinct colours to pens at once, then fill the layers
+    pen_of = map_colors(col for _, col in entries)
+    for col, layer in pen_of.items():
+        if col:
+            detected.append({'original': col, 'mapped_to': layer})
+    for p, col in entries:
+        if pen_of[col] is not None:
+            layers[pen_of[col]].append(p)
+
+    # 4) drop paths wholly outside the viewBox / bed before they are parsed or
+    #    deduped; paths crossing the boundary are cut while compiling
+    layers, culled = cull_layers(layers, root)
+    if culled and app_logger:
+        app_logger.info(f"Skipped {culled} paths outside the drawable area")
+
+    # 5) drop stacked copies of the same outline (within and across layers)
+    if DEDUPE_PATHS:
+        layers, removed = dedupe_layers(layers)
+        if removed:
+            if stats is not None:
+                stats['duplicates_removed'] = removed
+            if app_logger:
+                app_logger.info(f"Removed duplicate paths: {removed}")
+
+    # 6) compile each non-empty layer
     gcode_files = {}
-    for color, elems in layers.items():
-        if not elems:
-            continue
-        wrapper = ET.Element('svg', {'xmlns': svg_ns['svg'], **root.attrib})
-        for e in elems:
-            wrapper.append(e)
-        svg_out = os.path.join(folder, f"{color}.svg")
-        ET.ElementTree(wrapper).write(svg_out, encoding='unicode', xml_declaration=True)
-
-        g = convert_svg_to_gcode(svg_out, color, speed,
-                                 output_folder=folder, app_logger=app_logger)
-        if g:
-            gcode_files[color] = g
-
-    # 4) final fallback: compile original SVG → black
-    if not gcode_files:
+    clip_stats = {}
+    failed = []
+    if on_progress:
+        on_progress('layers', 'start', weights={c: len(e) for c, e in layers.items() if e})
+    with tiling.TilePool() as tile_pool:
+        for color, elems in layers.items():
+            if not elems:
+                continue
+            layer_start = time.time()
+            wrapper = layer_root(root, elems)
+            svg_out = os.path.join(folder, f"{color}.svg")
+            ET.ElementTree(wrapper).write(svg_out, encoding='unicode', xml_declaration=True)
+
+            # large layers are compiled as spatial tiles in parallel processes
+            tiles = tiling.plan_tiles(elems, tile_pool.workers) if tile_pool.usable(len(elems)) else None
+            tile_params = ('tiles', len(tiles)) if tiles else ()
+            key = layer_cache.layer_key(layer_cache.layer_fingerprint(wrapper), color, speed, clip_bounds(root),
+                                        *tile_params)
+            gcode_out = os.path.join(folder, f"{color}.gcode")
+            # clip counts are cached with the layer, so a reused layer reports them too
+            layer_meta = {}
+            cached = layer_cache.fetch(key, gcode_out, layer_meta)
+            layer_clip = layer_meta.get('clipped', {})
+            if cached:
+                g = gcode_out
+            else:
+                if tiles:
+                    try:
+                        g = tiling.compile_tiled(tile_pool.get(), wrapper, tiles, color, speed, gcode_out,
+                                                 layer_clip)
+                    except Exception as e:
+                        if app_logger:
+                            app_logger.error(f"G-code gen error [{color}]: {e}")
+                        g = None
+                else:
+                    # compile straight from the in-memory layer instead of re-parsing svg_out
+                    g = convert_svg_to_gcode(wrapper, color, speed, output_folder=folder, app_logger=app_logger,
+                                             stats=layer_clip)
+                if g:
+                    layer_cache.store(key, g, {'clipped': layer_clip})
+            for name, count in layer_clip.items():
+                clip_stats[name] = clip_stats.get(name, 0) + count
+            if stats is not None:
+                stats.setdefault('reused' if cached else 'compiled', []).append(color)
+            if g:
+                gcode_files[color] = g
+                if on_layer:
+                    on_layer(color, g)
+            else:
+                failed.append(color)
+                if stats is not None:
+                    stats.setdefault('failed', []).append(color)
+            if on_progress:
+                on_progress('layer', 'done', color=color, paths=len(elems), cached=cached,
+                            tiles=len(tiles) if tiles else 1, seconds=round(time.time() - layer_start, 3))
+
+    # 7) final fallback: compile original SVG → black, only when nothing above
+    #    recognised any element; never in place of layers that failed
+    if failed and not gcode_files:
+        raise ValueError(f"G-code generation failed for layers: {', '.join(failed)}")
+    if not gcode_files and not entries:
         if app_logger:
             app_logger.warning("No layers → falling back to single black output")
-        black = convert_svg_to_gcode(svg_path, 'black', speed,
+        black = convert_svg_to_gcode(root, DEFAULT_PEN, speed,
                                      output_folder=folder, app_logger=app_logger)
         if black:
-            gcode_files['black'] = black
+            gcode_files[DEFAULT_PEN] = black
+            if on_layer:
+                on_layer(DEFAULT_PEN, black)
             if not detected:
-                detected.append({'original': 'default', 'mapped_to': 'black'})
-
+                detected.append({'original': 'default', 'mapped_to': DEFAULT_PEN})
+
+    if culled:
+        clip_stats['culled'] = culled
+    if clip_stats and stats is not None:
+        stats['clipped'] = clip_stats
+    if on_progress:
+        on_progress('layers', 'done', layers=len(gcode_files))
     return detected, gcode_files
 
 
 def split_svg_by_color(svg_path, output_folder=None, app_logger=None):
     """
-    Legacy fallback: emit one .svg per CMYK channel.
+    Legacy fallback: emit one .svg per pen layer.
     Shapes are similarly converted → <path>.
+    `svg_path` may be a path, the raw SVG bytes or a parsed root element.
     """
     folder = output_folder or UPLOAD_FOLDER
     os.makedirs(folder, exist_ok=True)
 
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
+    root = load_svg_root(svg_path)
     svg_ns = {'svg': 'http://www.w3.org/2000/svg'}
-    layers = {c: [] for c in CMYK_CHANNELS}
+    layers = {c: [] for c in PEN_NAMES}
+    entries = []
 
     def bucket(elem):
         # prioritize stroke over fill
@@ -296,11 +463,9 @@ def split_svg_by_color(svg_path, output_folder=None, app_logger=None):
             m = re.search(r'(?:stroke|fill)\s*:\s*([^;]+)', elem.attrib['style'])
             if m:
                 col = m.group(1).strip()
-        rgb   = normalize_color(col)
-        layer = rgb_to_cmyk(*rgb) if rgb else 'black'
         path = elem if elem.tag.endswith('path') else shape_to_path(elem)
         if path is not None:
-            layers[layer].append(path)
+            entries.append((path, col))
 
     # gather paths & shapes
     for p in root.findall('.//svg:path', namespaces=svg_ns):
@@ -309,15 +474,19 @@ def split_svg_by_color(svg_path, output_folder=None, app_logger=None):
     for tag in ['rect','circle','ellipse','line','polyline','polygon']:
         for el in root.findall(f'.//svg:{tag}', namespaces=svg_ns):
             bucket(el)
+    for p in text_paths(root):
+        bucket(p)
+    pen_of = map_colors(col for _, col in entries)
+    for path, col in entries:
+        if pen_of[col] is not None:
+            layers[pen_of[col]].append(path)
 
     # write out per-layer SVGs
     svg_layers = {}
     for color, elems in layers.items():
         if not elems:
             continue
-        wrapper = ET.Element('svg', {'xmlns': svg_ns['svg'], **root.attrib})
-        for e in elems:
-            wrapper.append(e)
+        wrapper = layer_root(root, elems)
         out_svg = os.path.join(folder, f"{color}.svg")
         ET.ElementTree(wrapper).write(out_svg, encoding='unicode', xml_declaration=True)
         svg_layers[color] = out_svg
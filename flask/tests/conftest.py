@@ -0,0 +1,35 @@
+import io
+import os
+import sys
+import tempfile
+import pytest
+
+# The app modules live one directory up and read their settings on import,
+# so keep uploads and caches out of the checkout before anything imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_scratch = tempfile.mkdtemp(prefix='cncweb-tests-')
+os.environ.setdefault('ARTIFACT_ROOT', os.path.join(_scratch, 'uploads'))
+os.environ.setdefault('LAYER_CACHE_DIR', '')
+os.environ.setdefault('GLYPH_CACHE_DIR', '')
+
+# A black square and a magenta circle on a 50 x 50 canvas
+SVG = (b'<svg xmlns="http://www.w3.org/2000/svg" width="50" height="50">'
+       b'<rect x="5" y="5" width="20" height="20" fill="#000000"/>'
+       b'<circle cx="30" cy="30" r="10" fill="#ec008c"/></svg>')
+
+
+def upload(data=SVG, filename='drawing.svg', speed='1000'):
+    """Multipart form for the convert endpoints."""
+    return {'svg_file': (io.BytesIO(data), filename), 'speed': speed}
+
+
+def run_in_process(func, args=(), kwargs=None, **budget):
+    """Stand-in for conversion_budget.run_with_budget that skips the worker process."""
+    return func(*args, **(kwargs or {}))
+
+
+@pytest.fixture
+def client():
+    from app import app
+    app.config['TESTING'] = True
+    return app.test_client()
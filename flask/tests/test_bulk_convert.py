@@ -0,0 +1,41 @@
+import time
+import signal
+import pytest
+import bulk_convert
+from conftest import SVG
+
+
+@pytest.fixture
+def alarm_handler():
+    previous = signal.signal(signal.SIGALRM, bulk_convert._on_alarm)
+    yield
+    signal.alarm(0)
+    signal.signal(signal.SIGALRM, previous)
+
+
+def _task(tmp_path, timeout):
+    src = tmp_path / 'slow.svg'
+    src.write_bytes(SVG)
+    return 'slow.svg', str(src), str(tmp_path / 'out' / 'slow'), None, 155, False, timeout
+
+
+def test_file_over_its_time_limit_fails_and_clears_the_alarm(tmp_path, monkeypatch, alarm_handler):
+    monkeypatch.setattr(bulk_convert, 'convert_svg_to_separated_gcode', lambda *args, **kwargs: time.sleep(30))
+    start = time.monotonic()
+    entry = bulk_convert.convert_file(_task(tmp_path, 1))
+    assert time.monotonic() - start < 10
+    assert entry['status'] == 'failed'
+    assert entry['error'] == 'timed out after 1 seconds'
+    # no alarm left pending for the pool worker's next file, and no scratch output
+    assert signal.alarm(0) == 0
+    assert not list((tmp_path / 'out').iterdir())
+
+
+def test_failing_file_clears_the_alarm(tmp_path, monkeypatch, alarm_handler):
+    def fail(*args, **kwargs):
+        raise RuntimeError('broken')
+    monkeypatch.setattr(bulk_convert, 'convert_svg_to_separated_gcode', fail)
+    entry = bulk_convert.convert_file(_task(tmp_path, 60))
+    assert entry['status'] == 'failed'
+    assert entry['error'] == 'RuntimeError: broken'
+    assert signal.alarm(0) == 0
@@ -0,0 +1,43 @@
+import time
+import pytest
+import app as app_module
+from conftest import upload
+from conversion_budget import run_with_budget, ConversionTimeout, ConversionMemoryExceeded
+
+
+def _hold_memory(mb):
+    block = b'x' * (mb * 1024 * 1024)
+    time.sleep(30)
+    return len(block)
+
+
+def test_timeout_kills_the_worker():
+    start = time.monotonic()
+    with pytest.raises(ConversionTimeout) as info:
+        run_with_budget(time.sleep, (30,), timeout=1, max_rss_mb=0)
+    assert time.monotonic() - start < 10
+    assert info.value.status_code == 504
+    assert info.value.limit == 1
+
+
+def test_memory_limit_kills_the_worker():
+    with pytest.raises(ConversionMemoryExceeded) as info:
+        run_with_budget(_hold_memory, (256,), timeout=20, max_rss_mb=128)
+    assert info.value.status_code == 413
+    assert info.value.limit == 128
+
+
+@pytest.mark.parametrize('error, status, code', [
+    (ConversionTimeout('Conversion exceeded 30 seconds', 30), 504, 'timeout'),
+    (ConversionMemoryExceeded('Conversion exceeded 400 MB of memory', 400), 413, 'memory_limit'),
+])
+def test_budget_errors_map_to_http_status(client, monkeypatch, error, status, code):
+    def exceed(*args, **kwargs):
+        raise error
+    monkeypatch.setattr(app_module, 'run_with_budget', exceed)
+    response = client.post('/api/convert', data=upload(), content_type='multipart/form-data')
+    assert response.status_code == status
+    body = response.get_json()
+    assert body['success'] is False
+    assert body['error'] == code
+    assert body['limit'] == error.limit
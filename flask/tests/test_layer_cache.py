@@ -0,0 +1,22 @@
+import layer_cache
+from svg_utils import convert_svg_to_separated_gcode
+
+# One square crossing the left edge of the canvas, one wholly outside it
+CROPPED_SVG = (b'<svg xmlns="http://www.w3.org/2000/svg" width="50" height="50">'
+               b'<rect x="-10" y="5" width="20" height="20" fill="#000000"/>'
+               b'<rect x="100" y="5" width="20" height="20" fill="#000000"/></svg>')
+
+
+def test_reused_layer_reports_its_clip_counts(tmp_path, monkeypatch):
+    monkeypatch.setattr(layer_cache, 'LAYER_CACHE_DIR', str(tmp_path / 'cache'))
+    first, second = {}, {}
+    _, compiled = convert_svg_to_separated_gcode(CROPPED_SVG, 1000, str(tmp_path / 'first'), stats=first)
+    _, reused = convert_svg_to_separated_gcode(CROPPED_SVG, 1000, str(tmp_path / 'second'), stats=second)
+
+    assert first['compiled'] == ['black']
+    assert second['reused'] == ['black']
+    assert first['clipped']['clipped'] >= 1
+    assert first['clipped']['culled'] == 1
+    assert second['clipped'] == first['clipped']
+    with open(compiled['black']) as a, open(reused['black']) as b:
+        assert a.read() == b.read()
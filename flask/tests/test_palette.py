@@ -0,0 +1,38 @@
+from collections import Counter
+import pytest
+from palette import assign_colors, load_palette
+
+NAMED = {
+    'red': ((255, 0, 0), 'magenta'),
+    'purple': ((128, 0, 128), 'magenta'),
+    'green': ((0, 128, 0), 'yellow'),
+    'lime': ((0, 255, 0), 'yellow'),
+    'orange': ((255, 165, 0), 'yellow'),
+    'gold': ((255, 215, 0), 'yellow'),
+    'blue': ((0, 0, 255), 'cyan'),
+    'navy': ((0, 0, 128), 'cyan'),
+    'teal': ((0, 128, 128), 'cyan'),
+    'skyblue': ((135, 206, 235), 'cyan'),
+    'grey': ((128, 128, 128), 'black'),
+    'silver': ((192, 192, 192), 'black'),
+    'black': ((0, 0, 0), 'black'),
+    'white': ((255, 255, 255), None),
+}
+
+
+@pytest.mark.parametrize('name', sorted(NAMED))
+def test_colour_goes_to_the_pen_of_its_hue(name):
+    rgb, pen = NAMED[name]
+    assert assign_colors(Counter({rgb: 1}))[rgb] == pen
+
+
+@pytest.mark.parametrize('mode', ['auto', 'nearest', 'kmeans'])
+def test_document_colours_keep_their_pens_together(mode):
+    mapping = assign_colors(Counter(rgb for rgb, _ in NAMED.values()), mode=mode)
+    assert {name: mapping[rgb] for name, (rgb, _) in NAMED.items()} == {name: pen for name, (_, pen) in NAMED.items()}
+
+
+def test_greys_go_to_the_pen_of_closest_lightness():
+    pens = load_palette('cyan=#00aeef,grey=#999999,black=#000000')
+    mapping = assign_colors(Counter({(40, 40, 40): 1, (170, 170, 170): 1, (250, 250, 250): 1}), pens=pens)
+    assert mapping == {(40, 40, 40): 'black', (170, 170, 170): 'grey', (250, 250, 250): None}
@@ -0,0 +1,37 @@
+import json
+import app as app_module
+import traffic_capture
+from conftest import upload, run_in_process
+
+
+def _captured(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_stream_is_recorded_with_its_final_result(client, monkeypatch, tmp_path):
+    trace = tmp_path / 'trace.jsonl'
+    monkeypatch.setattr(traffic_capture, 'CAPTURE_FILE', str(trace))
+    monkeypatch.setattr(app_module, 'run_with_budget', run_in_process)
+    response = client.post('/api/convert/stream?format=jsonl', data=upload(), content_type='multipart/form-data')
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line.strip()]
+    result = events[-1]
+    assert result['stage'] == 'result'
+    assert result['status_code'] == 200
+
+    [entry] = _captured(trace)
+    assert entry['endpoint'] == '/api/convert/stream'
+    assert entry['filename'] == 'drawing.svg'
+    assert entry['speed'] == '1000'
+    assert entry['status'] == 200
+    assert entry['success'] is True
+    assert entry['processing_time'] == result['result']['processing_time']
+
+
+def test_rejected_stream_is_recorded(client, monkeypatch, tmp_path):
+    trace = tmp_path / 'trace.jsonl'
+    monkeypatch.setattr(traffic_capture, 'CAPTURE_FILE', str(trace))
+    response = client.post('/api/convert/stream', data=upload(speed='fast'), content_type='multipart/form-data')
+    assert response.status_code == 400
+    [entry] = _captured(trace)
+    assert entry['status'] == 400
+    assert entry['success'] is False
@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import hashlib
+from functools import lru_cache
+from xml.etree import ElementTree as ET
+from artifacts import store as artifact_store
+
+try:
+    from fontTools.ttLib import TTFont
+    from fontTools.pens.basePen import BasePen
+except ImportError:
+    TTFont = None
+    BasePen = object
+
+# Convert <text> to path outlines with locally installed fonts (needs fontTools)
+TEXT_TO_PATHS = os.environ.get('TEXT_TO_PATHS', '1').lower() in ('1', 'true', 'yes')
+FONT_DIRS = os.environ.get('FONT_DIRS', '/usr/share/fonts:/usr/local/share/fonts:~/.fonts')
+# Used when none of a text's font-family entries is installed
+DEFAULT_FONT_FAMILY = os.environ.get('DEFAULT_FONT_FAMILY', 'DejaVu Sans')
+# Glyph outlines kept in memory per (font, size, glyph)
+GLYPH_CACHE_SIZE = int(os.environ.get('GLYPH_CACHE_SIZE', 4096))
+# Persist extracted glyphs across conversions (each runs in a fresh
+# process, so the memory cache only lasts one document); empty disables it.
+# The default sits beside the layer cache (see layer_cache.LAYER_CACHE_DIR).
+GLYPH_CACHE_DIR = os.environ.get('GLYPH_CACHE_DIR', artifact_store.cache_dir(
+    'glyph_cache', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'glyph_cache')))
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+GENERIC_FAMILIES = {'serif': 'dejavu serif', 'monospace': 'dejavu sans mono'}
+DEFAULT_FONT_SIZE = 16.0
+_FONT_SIZE_UNITS = {'': 1.0, 'px': 1.0, 'pt': 4 / 3, 'pc': 16.0, 'mm': 96 / 25.4, 'cm': 96 / 2.54, 'in': 96.0}
+_LENGTH_RE = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([a-z]*)')
+_FONT_EXTENSIONS = ('.ttf', '.otf')
+# Presentation properties that <tspan>s inherit from their <text>
+_INHERITED = ('font-family', 'font-size', 'font-weight', 'font-style', 'text-anchor', 'fill', 'stroke')
+
+
+def _num(value):
+    return f'{value:.3f}'.rstrip('0').rstrip('.') or '0'
+
+
+class _OutlinePen(BasePen):
+    """
+    Records a glyph as SVG path data scaled to the font size and y-flipped:
+    the first point relative to the glyph origin, then relative commands,
+    so placing the glyph only needs an absolute moveto.
+    """
+
+    def __init__(self, glyph_set, scale):
+        super().__init__(glyph_set)
+        self.scale = scale
+        self.first = None
+        self.parts = []
+        self.pos = self.start = (0.0, 0.0)
+
+    def _xy(self, pt):
+        return pt[0] * self.scale, -pt[1] * self.scale
+
+    def _rel(self, *points):
+        out = []
+        for pt in points:
+            x, y = self._xy(pt)
+            out.append(f'{_num(x - self.pos[0])},{_num(y - self.pos[1])}')
+        return ' '.join(out)
+
+    def _moveTo(self, pt):
+        if self.first is None:
+            self.first = self._xy(pt)
+        else:
+            self.parts.append('m' + self._rel(pt))
+        self.pos = self.start = self._xy(pt)
+
+    def _lineTo(self, pt):
+        self.parts.append('l' + self._rel(pt))
+        self.pos = self._xy(pt)
+
+    def _curveToOne(self, pt1, pt2, pt3):
+        self.parts.append('c' + self._rel(pt1, pt2, pt3))
+        self.pos = self._xy(pt3)
+
+    def _qCurveToOne(self, pt1, pt2):
+        self.parts.append('q' + self._rel(pt1, pt2))
+        self.pos = self._xy(pt2)
+
+    def _closePath(self):
+        self.parts.append('z')
+        self.pos = self.start
+
+
+@lru_cache(maxsize=None)
+def _font_index():
+    """{family (lower case): [(path, bold, italic)]} for the fonts under FONT_DIRS."""
+    index = {}
+    for base in FONT_DIRS.split(os.pathsep):
+        for dirpath, _, files in os.walk(os.path.expanduser(base)):
+            for name in sorted(files):
+                if not name.lower().endswith(_FONT_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    font = TTFont(path, lazy=True)
+                    names = font['name']
+                    family = names.getDebugName(16) or names.getDebugName(1)
+                    os2 = font['OS/2'] if 'OS/2' in font else None
+                except Exception:
+                    continue
+                if not family:
+                    continue
+                bold = bool(os2 and os2.usWeightClass >= 600)
+                italic = bool(os2 and os2.fsSelection & 1)
+                index.setdefault(family.lower(), []).append((path, bold, italic))
+    return index
+
+
+def preload():
+    """
+    Index the installed fonts now.  conversion calls this on import, which
+    happens in the conversion forkserver (see conversion_budget), so each
+    conversion process forked from it starts with the index instead of
+    walking FONT_DIRS again.
+    """
+    if TEXT_TO_PATHS and TTFont is not None:
+        _font_index()
+
+
+def find_font(families, bold=False, italic=False):
+    """Path of the installed face best matching a font-family list, falling back to DEFAULT_FONT_FAMILY."""
+    index = _font_index()
+    for family in list(families) + [DEFAULT_FONT_FAMILY.lower()]:
+        faces = index.get(GENERIC_FAMILIES.get(family, family))
+        if faces:
+            return min(faces, key=lambda face: (face[1] != bold) + (face[2] != italic))[0]
+    for family in sorted(index):
+        return index[family][0][0]
+    return None
+
+
+@lru_cache(maxsize=16)
+def _open_font(path):
+    font = TTFont(path, lazy=True)
+    return font.getGlyphSet(), font.getBestCmap() or {}, font['hmtx'], font['head'].unitsPerEm
+
+
+def _disk_path(font_path, size):
+    st = os.stat(font_path)
+    font_id = hashlib.sha256(f'{os.path.realpath(font_path)}|{st.st_mtime_ns}|{st.st_size}'.encode()).hexdigest()
+    return os.path.join(GLYPH_CACHE_DIR, font_id[:16], f'{_num(size)}.json')
+
+
+@lru_cache(maxsize=64)
+def _disk_glyphs(font_path, size):
+    """Glyphs persisted for one font and size; new ones are added in place and written by flush()."""
+    if not GLYPH_CACHE_DIR:
+        return {}
+    try:
+        with open(_disk_path(font_path, size)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_dirty = set()
+
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def glyph_outline(font_path, size, glyph_name):
+    """(first point, relative path data, advance) of one glyph at `size` px."""
+    stored = _disk_glyphs(font_path, size)
+    if glyph_name in stored:
+        first, rest, advance = stored[glyph_name]
+        return (tuple(first) if first else None), rest, advance
+    glyph_set, _, hmtx, units = _open_font(font_path)
+    scale = size / units
+    pen = _OutlinePen(glyph_set, scale)
+    glyph_set[glyph_name].draw(pen)
+    outline = pen.first, ''.join(pen.parts), hmtx[glyph_name][0] * scale
+    if GLYPH_CACHE_DIR:
+        stored[glyph_name] = outline
+        _dirty.add((font_path, size))
+    return outline
+
+
+def flush():
+    """Write glyphs extracted since the last flush to GLYPH_CACHE_DIR (atomic; failures only cost a re-extraction)."""
+    while _dirty:
+        font_path, size = _dirty.pop()
+        glyphs = _disk_glyphs(font_path, size)
+        try:
+            path = _disk_path(font_path, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # keep glyphs another process stored meanwhile
+            try:
+                with open(path) as f:
+                    glyphs.update({k: v for k, v in json.load(f).items() if k not in glyphs})
+            except (OSError, ValueError):
+                pass
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(glyphs, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+def _properties(elem, inherited):
+    props = dict(inherited)
+    for name in _INHERITED:
+        if elem.get(name):
+            props[name] = elem.get(name).strip()
+    for decl in elem.get('style', '').split(';'):
+        name, _, value = decl.partition(':')
+        if name.strip() in _INHERITED and value.strip():
+            props[name.strip()] = value.strip()
+    return props
+
+
+def _first_length(value):
+    m = _LENGTH_RE.match(value or '')
+    return float(m.group(1)) if m else None
+
+
+def _font_size(value):
+    m = _LENGTH_RE.match(value or '')
+    if not m or m.group(2) not in _FONT_SIZE_UNITS:
+        return DEFAULT_FONT_SIZE
+    return float(m.group(1)) * _FONT_SIZE_UNITS[m.group(2)]
+
+
+def _runs(elem, props, preserve):
+    """Walk a <text> in document order, yielding ('move', x, y, dx, dy) and ('text', string, props)."""
+    props = _properties(elem, props)
+    preserve = elem.get(XML_SPACE, preserve)
+    yield ('move', _first_length(elem.get('x')), _first_length(elem.get('y')),
+           _first_length(elem.get('dx')) or 0.0, _first_length(elem.get('dy')) or 0.0)
+    if elem.text:
+        yield ('text', elem.text, props, preserve)
+    for child in elem:
+        if child.tag.rsplit('}', 1)[-1] == 'tspan':
+            yield from _runs(child, props, preserve)
+        if child.tail:
+            yield ('text', child.tail, props, preserve)
+
+
+def text_to_paths(elem):
+    """
+    Outline a <text> element: one <path> per fill/stroke combination,
+    glyphs placed along the baseline by their advance widths and shifted
+    per text chunk for text-anchor.  Honours x/y/dx/dy (first value),
+    font-family/size/weight/style and xml:space; no kerning, rotation or
+    textPath.  Returns [] when fontTools or a usable font is missing.
+    """
+    if TTFont is None:
+        return []
+    chunks = []
+    x = y = 0.0
+    collapse_space = True
+    for run in _runs(elem, {}, 'default'):
+        if run[0] == 'move':
+            _, nx, ny, dx, dy = run
+            if nx is not None or ny is not None or not chunks:
+                chunks.append([])
+            x = (x if nx is None else nx) + dx
+            y = (y if ny is None else ny) + dy
+            continue
+        _, text, props, preserve = run
+        if preserve != 'preserve':
+            text = re.sub(r'\s+', ' ', text)
+            if collapse_space:
+                text = text.lstrip(' ')
+        if not text:
+            continue
+        collapse_space = preserve != 'preserve' and text.endswith(' ')
+        families = [f.strip().strip('\'"').lower() for f in props.get('font-family', '').split(',') if f.strip()]
+        weight = props.get('font-weight', 'normal')
+        bold = weight in ('bold', 'bolder') or (weight.isdigit() and int(weight) >= 600)
+        italic = props.get('font-style', 'normal') in ('italic', 'oblique')
+        font_path = find_font(families, bold, italic)
+        if font_path is None:
+            return []
+        size = _font_size(props.get('font-size'))
+        _, cmap, _, _ = _open_font(font_path)
+        for char in text:
+            glyph_name = cmap.get(ord(char), '.notdef')
+            first, rest, advance = glyph_outline(font_path, size, glyph_name)
+            if first is not None:
+                chunks[-1].append((x, y, first, rest, props))
+            x += advance
+        chunks[-1].append((x, y, None, '', props))
+
+    paths = {}
+    for chunk in chunks:
+        if not chunk:
+            continue
+        anchor = chunk[0][4].get('text-anchor', 'start')
+        width = chunk[-1][0] - chunk[0][0]
+        shift = -width if anchor == 'end' else -width / 2 if anchor == 'middle' else 0.0
+        for gx, gy, first, rest, props in chunk:
+            if first is None:
+                continue
+            key = (props.get('fill'), props.get('stroke'))
+            paths.setdefault(key, []).append(f'M{_num(gx + shift + first[0])},{_num(gy + first[1])}{rest}')
+
+    out = []
+    for (fill, stroke), parts in paths.items():
+        p = ET.Element(f'{{{SVG_NS}}}path', {'d': ' '.join(parts)})
+        if fill:
+            p.set('fill', fill)
+        if stroke:
+            p.set('stroke', stroke)
+        if elem.get('transform'):
+            p.set('transform', elem.get('transform'))
+        out.append(p)
+    return out
@@ -0,0 +1,138 @@
+import os
+import math
+import multiprocessing
+from xml.etree import ElementTree as ET
+import svg_utils
+from dedupe import path_segments
+from admission import MAX_CONVERSIONS
+
+# Layers with at least TILE_MIN_PATHS paths are split into spatial tiles
+# compiled by TILE_WORKERS processes; 1 disables tiling.  The default gives
+# each of the MAX_CONVERSIONS conversions a worker may run its share of the
+# cores, but at least two processes on a multi-core host: tiles only
+# time-share under full load, while a lone large upload gets the spare
+# cores.  Tile processes count towards their conversion's memory budget.
+_CORES = multiprocessing.cpu_count()
+TILE_WORKERS = int(os.environ.get('TILE_WORKERS', min(_CORES, max(2, _CORES // MAX_CONVERSIONS))))
+TILE_MIN_PATHS = int(os.environ.get('TILE_MIN_PATHS', 64))
+# More tiles than workers, so uneven tiles still keep every worker busy
+TILES_PER_WORKER = 4
+
+
+def element_center(elem):
+    """Centre of a path's control-point bounding box in user units, or None if it cannot be placed cheaply."""
+    if elem.get('transform'):
+        return None
+    segments = path_segments(elem.get('d', ''))
+    if not segments:
+        return None
+    xs = [p[0] for seg in segments for p in seg[1:]]
+    ys = [p[1] for seg in segments for p in seg[1:]]
+    return (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+
+
+def plan_tiles(elems, workers=TILE_WORKERS):
+    """
+    Group a layer's path elements into spatial tiles, each path wholly in the
+    tile holding its centre (so it is parsed exactly once and never cut at a
+    seam).  Tiles come back in serpentine row order, so consecutive tiles
+    are neighbours and the merged G-code travels little between them;
+    within a tile paths keep their document order.  Tiles much heavier than
+    average are split further so one dense region cannot serialise the run.
+    """
+    centers = [element_center(e) for e in elems]
+    placed = [c for c in centers if c is not None]
+    side = max(1, math.ceil(math.sqrt(workers * TILES_PER_WORKER)))
+    cells = {}
+    unplaced = []
+    if placed:
+        x0, x1 = min(c[0] for c in placed), max(c[0] for c in placed)
+        y0, y1 = min(c[1] for c in placed), max(c[1] for c in placed)
+        width = (x1 - x0) or 1.0
+        height = (y1 - y0) or 1.0
+    for elem, center in zip(elems, centers):
+        if center is None:
+            unplaced.append(elem)
+            continue
+        col = min(int((center[0] - x0) / width * side), side - 1)
+        row = min(int((center[1] - y0) / height * side), side - 1)
+        cells.setdefault((row, col), []).append(elem)
+
+    ordered = []
+    for row in range(side):
+        cols = range(side) if row % 2 == 0 else range(side - 1, -1, -1)
+        ordered.extend(cells[(row, col)] for col in cols if (row, col) in cells)
+    if unplaced:
+        ordered.append(unplaced)
+
+    total = sum(len(e.get('d', '')) for e in elems)
+    limit = max(1, total // (workers * 2))
+    tiles = []
+    for tile in ordered:
+        chunk, weight = [], 0
+        for elem in tile:
+            chunk.append(elem)
+            weight += len(elem.get('d', ''))
+            if weight >= limit:
+                tiles.append(chunk)
+                chunk, weight = [], 0
+        if chunk:
+            tiles.append(chunk)
+    return tiles
+
+
+def _compile_tile(job):
+    root_attrib, elem_attribs, color, speed = job
+    wrapper = ET.Element(f'{{{svg_utils.SVG_NS}}}svg', root_attrib)
+    for attrib in elem_attribs:
+        ET.SubElement(wrapper, f'{{{svg_utils.SVG_NS}}}path', attrib)
+    stats = {}
+    comp = svg_utils.compile_layer(wrapper, color, speed, stats)
+    return comp.body, stats
+
+
+def compile_tiled(pool, root, tiles, color, speed, out_file, stats=None):
+    """Compile tiles in parallel and write one layer file with their bodies merged in tile order."""
+    jobs = [(dict(root.attrib), [dict(e.attrib) for e in tile], color, speed) for tile in tiles]
+    comp = svg_utils.new_compiler(color, speed)
+    for body, tile_stats in pool.imap(_compile_tile, jobs):
+        comp.body.extend(body)
+        if stats is not None:
+            for name, count in tile_stats.items():
+                stats[name] = stats.get(name, 0) + count
+    comp.compile_to_file(out_file)
+    return out_file
+
+
+class TilePool:
+    """
+    Worker pool for tiled layers, created on first use and shared by all
+    layers of one conversion.  usable() is False where tiling does not
+    apply: small layers, a single worker, or a daemonic process (such as a
+    bulk_convert pool worker) that may not start children.
+    """
+
+    def __init__(self, workers=TILE_WORKERS):
+        self.workers = workers
+        self._pool = None
+
+    def usable(self, paths):
+        return (self.workers > 1 and paths >= TILE_MIN_PATHS
+                and not multiprocessing.current_process().daemon)
+
+    def get(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        return self._pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._pool is not None:
+            if exc_type is None:
+                self._pool.close()
+            else:
+                self._pool.terminate()
+            self._pool.join()
+        return False
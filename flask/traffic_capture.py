@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from functools import wraps
+from flask import request, current_app
+
+# Capture is off unless a trace file is configured.  When it is off the
+# decorator hands back the view untouched, so there is no per-request cost.
+CAPTURE_FILE = os.environ.get('TRAFFIC_CAPTURE_FILE')
+# Optional directory where each distinct upload is archived as <sha256>.svg
+ARCHIVE_DIR = os.environ.get('TRAFFIC_CAPTURE_ARCHIVE')
+
+_write_lock = threading.Lock()
+
+
+def archive_upload(data, digest):
+    """Store the upload under its content hash (once) so it can be replayed."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"{digest}.svg")
+    if os.path.exists(path):
+        return path
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def record_request(entry):
+    """Append one JSON line to the trace file."""
+    line = json.dumps(entry) + '\n'
+    with _write_lock:
+        with open(CAPTURE_FILE, 'a') as f:
+            f.write(line)
+
+
+def _begin_capture():
+    """Arrival time, endpoint and upload details of the current request (archiving the upload if configured)."""
+    entry = {'arrival': time.time(), 'endpoint': request.path, 'sha256': None, 'size': None, 'filename': None}
+    file = request.files.get('svg_file')
+    if file is not None:
+        data = file.read()
+        file.seek(0)
+        entry.update(sha256=hashlib.sha256(data).hexdigest(), size=len(data), filename=file.filename)
+        if ARCHIVE_DIR and data:
+            try:
+                archive_upload(data, entry['sha256'])
+            except OSError as e:
+                current_app.logger.warning(f"Could not archive upload {entry['sha256']}: {e}")
+    entry['speed'] = request.form.get('speed')
+    return entry
+
+
+def _finish_capture(entry, status, body, logger):
+    entry.update({
+        'status': status,
+        'success': bool(body.get('success')) if isinstance(body, dict) else None,
+        'latency': round(time.time() - entry['arrival'], 4),
+        'processing_time': body.get('processing_time') if isinstance(body, dict) else None,
+    })
+    try:
+        record_request(entry)
+    except OSError as e:
+        logger.warning(f"Could not write traffic capture: {e}")
+
+
+def capture_traffic(view):
+    """
+    Record arrival time, upload hash/size, speed and outcome of every call
+    to the wrapped view.  The trace is consumed by evaluation/replay_traffic.py.
+    Streaming views return before their work is done; use capture_stream.
+    """
+    if not CAPTURE_FILE:
+        return view
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        entry = _begin_capture()
+        response = current_app.make_response(view(*args, **kwargs))
+        body = response.get_json(silent=True) if response.is_json else None
+        _finish_capture(entry, response.status_code, body, current_app.logger)
+        return response
+    return wrapper
+
+
+def capture_stream():
+    """
+    For a streaming view: starts the record of the current request and
+    returns record(status_code, body), to be called (from any thread) with
+    the final result once the work is done; None when capture is off.
+    """
+    if not CAPTURE_FILE:
+        return None
+    entry = _begin_capture()
+    logger = current_app.logger
+    return lambda status, body: _finish_capture(entry, status, body, logger)
@@ -0,0 +1,26 @@
+"""
+WSGI entry point for production (gunicorn -c gunicorn.conf.py wsgi:app).
+
+gunicorn preloads this module in the master before forking, so the app and
+the libraries the request handlers use are imported once and shared
+copy-on-write by every worker.
+
+Conversions do not run in these processes: each worker starts its own
+forkserver (see conversion_budget.py), which imports svg_utils and
+conversion once and forks every conversion of that worker from itself.
+Conversions share the forkserver's copy, not the master's, so every extra
+gunicorn worker costs one more copy of the conversion libraries.
+"""
+# Imported for their side effect of loading native libraries and parser
+# tables before fork, rather than in each worker on its first request.
+import cairosvg  # noqa: F401
+from PIL import Image, ImageDraw  # noqa: F401
+from svg_to_gcode.svg_parser import parse_file  # noqa: F401
+from svg_to_gcode.compiler import Compiler, interfaces  # noqa: F401
+
+from app import app
+from svg_utils import normalize_color
+
+# Warm the colour lookup (matplotlib's named-colour table when available)
+normalize_color('gold')
+normalize_color('steelblue')